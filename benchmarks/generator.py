@@ -0,0 +1,116 @@
+# Seeded generator of raw FinTS transaction data as returned by python-fints
+import random
+from datetime import date, timedelta
+
+from mt940.models import Amount
+
+APPLICANTS = [
+    "REWE Markt GmbH",
+    "EDEKA Center Mueller",
+    "Stadtwerke Muenchen Gmbh",
+    "DB Vertrieb GmbH",
+    "Amzn Mktp De*2K4LR58T5",
+    "PayPal Europe S.a.r.l. et Cie S.C.A",
+    "Vodafone Gmbh",
+    "Finanzamt Muenchen",
+    "Arbeitgeber Gmbh",
+    "Visa Card Transact Lidl Dienstleistung",
+    "Sumup  *Baeckerei Schmidt",
+    "Itunes.Com/Bill",
+]
+
+PURPOSES = [
+    "Lastschrift Ref. {ref} Mandat {ref} Glaeubiger-ID DE98ZZZ09999999999",
+    "Gehalt {month} {year}",
+    "Miete Wohnung Hauptstr. {number} {month}",
+    "VISA Debitkartekaufumsatz{day:02d}.{monthnum:02d}"
+    "{hour:02d}{minute:02d}{second:02d} Arn{ref}",
+    "Kartenzahlung girocard {year}-{monthnum:02d}-{day:02d} Debitk.{number}",
+    "Bargeldauszahlung{day:02d}.{monthnum:02d}{hour:02d}{minute:02d}{second:02d}"
+    " Geldautomat",
+    "Gutschriftsbeleg{day:02d}.{monthnum:02d} Erstatt Bestellung {ref}",
+    "Auszahlung0,00 Auslandseinsatzentgeltkreditkarte",
+    "EREF+{ref} MREF+{ref} CRED+DE98ZZZ09999999999 SVWZ+Abo {month}",
+]
+
+# Credit card statements carry the merchant in the purpose and no applicant,
+# see `transactions.re_cc_purpose`
+CC_PURPOSES = [
+    "Amzn Mktp De*2K4LR58T5 Amazon.De LuEUR   {amount} Arn{ref}",
+    "Google *Youtube Premium g.co/helppay#USD   {amount} Kurs 1,0821",
+    "Uber *Trip Help.Uber.ComEUR   {amount}",
+    "Spotify P1A2B3C4D5 StockholmSEK   {amount} Kurs 11,4523",
+]
+
+MONTHS = [
+    "Januar",
+    "Februar",
+    "Maerz",
+    "April",
+    "Mai",
+    "Juni",
+    "Juli",
+    "August",
+    "September",
+    "Oktober",
+    "November",
+    "Dezember",
+]
+
+
+def generate_transaction(rng, entry_date):
+    value = round(rng.lognormvariate(3, 1.2), 2)
+    status = "D" if rng.random() < 0.85 else "C"
+    fields = {
+        "ref": rng.randrange(10**8, 10**12),
+        "number": rng.randrange(1, 200),
+        "day": entry_date.day,
+        "monthnum": entry_date.month,
+        "month": MONTHS[entry_date.month - 1],
+        "year": entry_date.year,
+        "hour": rng.randrange(24),
+        "minute": rng.randrange(60),
+        "second": rng.randrange(60),
+        "amount": f"{value:.2f}".replace(".", ","),
+    }
+
+    if rng.random() < 0.2:
+        applicant_name = None
+        purpose = rng.choice(CC_PURPOSES).format(**fields)
+    else:
+        applicant_name = rng.choice(APPLICANTS)
+        purpose = rng.choice(PURPOSES).format(**fields)
+
+    return {
+        "status": status,
+        "funds_code": None,
+        "amount": Amount(f"{value:.2f}", status, "EUR"),
+        "id": "NMSC",
+        "customer_reference": "NONREF",
+        "bank_reference": None,
+        "extra_details": "",
+        "currency": "EUR",
+        "date": entry_date,
+        "entry_date": entry_date,
+        "transaction_code": "106",
+        "posting_text": "Lastschrift" if status == "D" else "Gutschrift",
+        "prima_nota": str(rng.randrange(1000, 9999)),
+        "purpose": purpose,
+        "applicant_bin": "DEUTDEMMXXX",
+        "applicant_iban": "DE89370400440532013000",
+        "applicant_name": applicant_name,
+        "return_debit_notes": None,
+        "recipient_name": None,
+        "additional_purpose": None,
+        "end_to_end_reference": None,
+    }
+
+
+def generate_transactions(count, seed=0, end=None):
+    """Yield `count` raw transactions, oldest first, ending at `end`."""
+    rng = random.Random(seed)
+    end = end or date.today()
+    per_day = 8
+    start = end - timedelta(days=count // per_day)
+    for index in range(count):
+        yield generate_transaction(rng, start + timedelta(days=index // per_day))
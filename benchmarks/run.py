@@ -0,0 +1,283 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+# Keep benchmark runs away from the user's cache before cleanab computes CACHE_HOME
+os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="cleanab-benchmark-")
+
+import logzero  # noqa: E402
+import yaml  # noqa: E402
+
+from cleanab.cleaner import FieldCleaner  # noqa: E402
+from cleanab.cli import Cleanab  # noqa: E402
+from cleanab.models.config import Config  # noqa: E402
+from cleanab.transactions import process_transaction  # noqa: E402
+
+from .generator import generate_transactions  # noqa: E402
+
+CONFIG_PATH = Path(__file__).parent / "config.yaml"
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+
+# Trace allocations while measuring; set by --memory
+TRACE_MEMORY = False
+
+
+@contextmanager
+def measure():
+    """Time the block and, with TRACE_MEMORY, record the memory it allocated.
+
+    Results still referenced after the block count as retained memory.
+    """
+    result = {}
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["seconds"] = time.perf_counter() - start
+        if TRACE_MEMORY:
+            (
+                result["retained_bytes"],
+                result["peak_bytes"],
+            ) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+
+def load_config():
+    with open(CONFIG_PATH) as f:
+        return Config.parse_obj(yaml.safe_load(f))
+
+
+def make_cleaner(config):
+    return FieldCleaner(
+        config.replacements,
+        config.finalizer,
+        sequential=config.cleanab.sequential_rules,
+    )
+
+
+def bench_process_transaction(config, size, seed):
+    cleaner = make_cleaner(config)
+    transactions = list(generate_transactions(size, seed=seed))
+    with measure() as result:
+        processed = [process_transaction(t, cleaner) for t in transactions]
+    del processed
+    return result
+
+
+def bench_clean(config, size, seed):
+    cleaner = make_cleaner(config)
+    fields = cleaner.fields
+    transactions = [
+        {field: t[field] for field in fields}
+        for t in generate_transactions(size, seed=seed)
+    ]
+    with measure() as result:
+        for data in transactions:
+            cleaner.clean(data)
+    return result
+
+
+def _augment(config, size, seed, app_module, app_config):
+    from cleanab.apps.base import load_app
+
+    App, AppConfig = load_app(app_module)
+    app = App(AppConfig.parse_obj(app_config))
+    cleaner = make_cleaner(config)
+    account = config.accounts[0]
+    processed = [
+        process_transaction(t, cleaner) for t in generate_transactions(size, seed=seed)
+    ]
+    with measure() as result:
+        augmented = [
+            app.augment_transaction(transaction, account)
+            for transaction in processed
+            if transaction
+        ]
+    del augmented
+    return result
+
+
+def bench_augment_ynab5(config, size, seed):
+    return _augment(
+        config,
+        size,
+        seed,
+        "cleanab.apps.ynab5",
+        {
+            "access_token": "benchmark",
+            "budget_id": "00000000-0000-0000-0000-000000000000",
+        },
+    )
+
+
+def bench_augment_firefly_iii_fidi(config, size, seed):
+    return _augment(
+        config, size, seed, "cleanab.apps.firefly_iii_fidi", config.app_config
+    )
+
+
+class BenchmarkCleanab(Cleanab):
+    def __init__(self, *, raw_transactions, **kwargs):
+        super().__init__(**kwargs)
+        self.raw_transactions = raw_transactions
+
+    def uses_account_cache(self, account):
+        # Never open a dialog with a bank
+        return True
+
+    def _get_fints_transactions(self, account, earliest, latest, login=None):
+        return self.raw_transactions[account.iban]
+
+
+def bench_run_dry(config, size, seed):
+    per_account = size // len(config.accounts)
+    raw_transactions = {
+        account.iban: list(generate_transactions(per_account, seed=seed + index))
+        for index, account in enumerate(config.accounts)
+    }
+    # Check back to the oldest generated transaction, fetched as a single window
+    earliest = min(
+        transaction["date"]
+        for transactions in raw_transactions.values()
+        for transaction in transactions
+    )
+    span = (date.today() - earliest).days + 1
+    config.timespan.earliest_date = earliest
+    config.timespan.maximum_days = span
+    config.timespan.window_days = span + 1
+    cleanab = BenchmarkCleanab(
+        config=config,
+        dry_run=True,
+        full=True,
+        raw_transactions=raw_transactions,
+    )
+    with measure() as result:
+        cleanab.setup()
+        cleanab.run()
+    return result
+
+
+BENCHMARKS = {
+    "process_transaction": bench_process_transaction,
+    "clean": bench_clean,
+    "augment_ynab5": bench_augment_ynab5,
+    "augment_firefly_iii_fidi": bench_augment_firefly_iii_fidi,
+    "run_dry": bench_run_dry,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names, sizes, seed, repeat):
+    results = []
+    for size in sizes:
+        for name in names:
+            measurements = []
+            error = None
+            for _ in range(repeat):
+                try:
+                    measurements.append(BENCHMARKS[name](load_config(), size, seed))
+                except ImportError as exc:
+                    error = f"skipped: {exc}"
+                    break
+
+            result = {"name": name, "size": size, "repeat": len(measurements)}
+            if measurements:
+                best = min(measurements, key=lambda m: m["seconds"])
+                result.update(
+                    seconds=round(best["seconds"], 6),
+                    us_per_transaction=round(best["seconds"] / size * 1e6, 3),
+                )
+                if TRACE_MEMORY:
+                    result.update(
+                        retained_bytes_per_transaction=round(
+                            best["retained_bytes"] / size, 1
+                        ),
+                        peak_bytes_per_transaction=round(best["peak_bytes"] / size, 1),
+                    )
+            else:
+                result["error"] = error
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run cleanab benchmarks")
+    parser.add_argument(
+        "--sizes",
+        type=lambda v: [int(s) for s in v.split(",")],
+        default=DEFAULT_SIZES,
+        help="Comma-separated numbers of transactions",
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        choices=list(BENCHMARKS),
+        help="Run only the given benchmark, may be repeated",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="Report the best of N")
+    parser.add_argument(
+        "--loglevel",
+        default="ERROR",
+        help="Log level of cleanab during the benchmark",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help=(
+            "Also report the memory allocated per transaction (traced, so timings"
+            " are slower)"
+        ),
+    )
+    parser.add_argument("-o", "--output", type=Path, help="Write JSON results here")
+    args = parser.parse_args(argv)
+
+    global TRACE_MEMORY
+    TRACE_MEMORY = args.memory
+    logzero.loglevel(getattr(logging, args.loglevel.upper()))
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "results": run_benchmarks(
+            args.only or list(BENCHMARKS), args.sizes, args.seed, args.repeat
+        ),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
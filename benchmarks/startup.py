@@ -0,0 +1,100 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .run import git_revision
+
+ROOT = Path(__file__).parent.parent
+
+# Modules that must only be imported once a bank or app is actually contacted
+LAZY_MODULES = ["fints", "ynab_api", "requests", "httpx", "urllib3"]
+
+COMMANDS = {
+    "import_cli": ["-c", "import cleanab.cli"],
+    "help": ["-m", "cleanab", "--help"],
+}
+
+
+def time_command(args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args], cwd=ROOT, check=True, capture_output=True
+        )
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def eagerly_imported():
+    check = (
+        "import json, sys, cleanab.cli;"
+        f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(result.stdout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of the cleanab command line"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Report the best of N")
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        help="Fail if starting the command line takes longer than this",
+    )
+    parser.add_argument("-o", "--output", type=Path, help="Write JSON results here")
+    args = parser.parse_args(argv)
+
+    # Warm up, so bytecode compilation is not part of the first measurement
+    time_command(COMMANDS["import_cli"], 1)
+
+    results = [
+        {
+            "name": name,
+            "repeat": args.repeat,
+            "seconds": round(time_command(command, args.repeat), 6),
+        }
+        for name, command in COMMANDS.items()
+    ]
+    imported = eagerly_imported()
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "eagerly_imported": imported,
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+    failures = []
+    if imported:
+        failures.append(f"imported at startup: {', '.join(imported)}")
+    slowest = max(result["seconds"] for result in results)
+    if args.max_seconds is not None and slowest > args.max_seconds:
+        failures.append(f"startup took {slowest:.3f}s (> {args.max_seconds}s)")
+    if failures:
+        sys.exit("Startup regression, " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
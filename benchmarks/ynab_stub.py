@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import logzero
+
+from cleanab.apps.base import UploadError
+from cleanab.apps.ynab5 import App, Config
+from cleanab.transactions import process_transaction
+
+from .generator import generate_transactions
+from .run import load_config, make_cleaner
+
+BUDGET_ID = "00000000-0000-0000-0000-000000000000"
+RATE_LIMIT = 200
+# Queued instead of a status, the stub answers only after the client timed out
+TIMEOUT = 0
+CLIENT_TIMEOUT = 0.2
+
+
+class StubYnab(BaseHTTPRequestHandler):
+    """Create transactions like YNAB, failing with the queued statuses first."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests += 1
+            status = server.failures.pop(0) if server.failures else 201
+            if status == 201:
+                server.bodies.append(body)
+            used = RATE_LIMIT if server.exhausted else server.requests
+
+        if status == TIMEOUT:
+            time.sleep(CLIENT_TIMEOUT * 5)
+            return
+
+        if status == 201:
+            import_ids = [t["import_id"] for t in body["transactions"]]
+            payload = {
+                "data": {
+                    "transaction_ids": import_ids,
+                    "duplicate_import_ids": [],
+                    "server_knowledge": server.requests,
+                }
+            }
+        else:
+            payload = {"error": {"id": str(status), "name": "stub", "detail": ""}}
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Rate-Limit", f"{used}/{RATE_LIMIT}")
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@contextmanager
+def stub_server(failures=(), exhausted=False):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubYnab)
+    server.lock = threading.Lock()
+    server.failures = list(failures)
+    server.exhausted = exhausted
+    server.requests = 0
+    server.bodies = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def make_app(server, batch_size):
+    host, port = server.server_address
+    return App(
+        Config(
+            access_token="stub",
+            budget_id=BUDGET_ID,
+            api_url=f"http://{host}:{port}/v1",
+            batch_size=batch_size,
+            backoff_factor=0,
+            timeout=CLIENT_TIMEOUT,
+        )
+    )
+
+
+def upload(app, transactions, use_async):
+    try:
+        if use_async:
+            return asyncio.run(app.create_transactions_async(transactions))
+        return app.create_transactions(transactions)
+    except UploadError as exc:
+        return exc.new, exc.duplicates
+
+
+def make_transactions(size, seed):
+    config = load_config()
+    cleaner = make_cleaner(config)
+    account = config.accounts[0]
+    app = App(Config(access_token="stub", budget_id=BUDGET_ID))
+    return [
+        app.augment_transaction(transaction, account)
+        for raw in generate_transactions(size, seed=seed)
+        if (transaction := process_transaction(raw, cleaner))
+    ]
+
+
+def sent_bodies(server):
+    # Batches are sent concurrently, so compare them regardless of order
+    return sorted(json.dumps(body, sort_keys=True) for body in server.bodies)
+
+
+def check_bodies(transactions, batch_size):
+    bodies = {}
+    for use_async in (False, True):
+        with stub_server() as server:
+            upload(make_app(server, batch_size), transactions, use_async)
+            bodies[use_async] = sent_bodies(server)
+    if bodies[False] != bodies[True]:
+        return ["sync and async uploads sent different request bodies"]
+    return []
+
+
+def check_retries(transactions, batch_size, use_async):
+    with stub_server(failures=[429, TIMEOUT, 503]) as server:
+        new, _ = upload(make_app(server, batch_size), transactions, use_async)
+        batches = len(server.bodies)
+        retried = server.requests - batches
+    if len(new) != len(transactions) or retried != 3:
+        return [f"created {len(new)} of {len(transactions)}, retried {retried} of 3"]
+    return []
+
+
+def check_rate_limit(transactions, batch_size, use_async):
+    with stub_server(exhausted=True) as server:
+        app = make_app(server, batch_size)
+        upload(app, transactions[:1], use_async)
+        server.exhausted = False
+        new, _ = upload(app, transactions[1:2], use_async)
+    if len(new) != 1:
+        return ["an exhausted rate limit blocked the next upload"]
+    return []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Check the requests of YNAB uploads, synchronous and async, against a"
+            " local stub server"
+        )
+    )
+    parser.add_argument("--size", type=int, default=600, help="Transactions to send")
+    parser.add_argument("--batch-size", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--loglevel", default="WARNING", help="Log level of cleanab")
+    args = parser.parse_args(argv)
+
+    logzero.loglevel(getattr(logging, args.loglevel.upper()))
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        sys.exit("The async upload requires httpx (pip install cleanab[async])")
+
+    transactions = make_transactions(args.size, args.seed)
+    failures = check_bodies(transactions, args.batch_size)
+    for use_async in (False, True):
+        mode = "async" if use_async else "sync"
+        for check in (check_retries, check_rate_limit):
+            failures += [
+                f"{mode}: {failure}"
+                for failure in check(transactions, args.batch_size, use_async)
+            ]
+
+    if failures:
+        sys.exit("YNAB upload regression, " + "; ".join(failures))
+    print(f"Checked uploads of {len(transactions)} transactions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from . import constants
 from .cli import cli
 
-cli(auto_envvar_prefix=constants.ENV_PREFIX)
+if __name__ == "__main__":
+    cli(auto_envvar_prefix=constants.ENV_PREFIX)
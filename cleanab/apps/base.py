@@ -1,13 +1,44 @@
+import asyncio
 from abc import ABC, abstractmethod
 from importlib import import_module
 from typing import List, Tuple
 
 
+class UploadError(Exception):
+    def __init__(self, message, new=(), duplicates=()):
+        super().__init__(message)
+        self.new = list(new)
+        self.duplicates = list(duplicates)
+
+
 class BaseApp(ABC):
+    import_index = None
+
+    def confirm_import_ids(self, entries):
+        if self.import_index is not None:
+            self.import_index.add(entries)
+
+    def fetch_import_ids(self, since_date):
+        raise NotImplementedError(f"{self} cannot list existing import ids")
+
+    def get_account_balances(self):
+        """Balances of all accounts in milliunits, by the app's account id."""
+        raise NotImplementedError(f"{self} cannot look up account balances")
+
+    async def get_account_balances_async(self):
+        return await asyncio.to_thread(self.get_account_balances)
+
+    def create_intermediary(self, transactions):
+        return None
+
     @abstractmethod
     def create_transactions(self, transactions) -> Tuple[List, List]:
         return [], []
 
+    async def create_transactions_async(self, transactions) -> Tuple[List, List]:
+        # Apps without a native implementation block a worker thread instead
+        return await asyncio.to_thread(self.create_transactions, list(transactions))
+
     @abstractmethod
     def augment_transaction(self, transaction, account):
         pass
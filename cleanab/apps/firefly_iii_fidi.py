@@ -1,15 +1,26 @@
+import asyncio
 import csv
 import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from functools import partial
-from io import StringIO
+from io import BytesIO, StringIO, TextIOWrapper
+from typing import Optional
 
 import requests
 from logzero import logger
-from pydantic import AnyHttpUrl, BaseModel
+from pydantic import AnyHttpUrl, BaseModel, confloat, conint
+from requests.adapters import HTTPAdapter
 
 from ..models import AccountConfig, FintsTransaction
-from .base import BaseApp
+from ..utils import chunked
+from .base import BaseApp, UploadError
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
 
 _firefly_iii_data_importer_base_config = {
     "version": 3,
@@ -54,6 +65,12 @@ class FireFlyIIIAppConfig(BaseModel):
     auto_import_secret: str
     personal_access_token: str
 
+    stream_uploads: bool = False
+    rows_per_upload: Optional[conint(gt=0)] = None
+    max_parallel_uploads: conint(gt=0) = 1
+    # Seconds to wait for FIDI, which imports before it responds
+    timeout: confloat(gt=0) = 300.0
+
 
 class FireFlyIIIApp(BaseApp):
     _CSV_FIELDNAMES = [
@@ -64,6 +81,8 @@ class FireFlyIIIApp(BaseApp):
         "amount",
         "external-id",
     ]
+    # Number of CSV rows encoded per chunk of a streamed upload body
+    _STREAM_CHUNK_ROWS = 500
 
     def __init__(self, config: FireFlyIIIAppConfig) -> None:
         self.config = config
@@ -71,12 +90,32 @@ class FireFlyIIIApp(BaseApp):
         self._generate_config_json()
 
     def _set_up_session(self):
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.config.max_parallel_uploads,
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers.update(self._headers)
         self._post = partial(
-            requests.post,
-            f"{self.config.fidi_url.rstrip('/')}/autoupload",
+            self._session.post,
+            self._autoupload_url,
             params={"secret": self.config.auto_import_secret},
+            timeout=self.config.timeout,
         )
 
+    @property
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.config.personal_access_token}",
+            "Accept": "application/json",
+        }
+
+    @property
+    def _autoupload_url(self):
+        return f"{self.config.fidi_url.rstrip('/')}/autoupload"
+
     def _generate_config_json(self):
         config = _firefly_iii_data_importer_base_config.copy()
         config.update(
@@ -89,40 +128,170 @@ class FireFlyIIIApp(BaseApp):
     def __str__(self):
         return f"FireFly III FIDI at {self.config.fidi_url}"
 
-    def create_intermediary(self, transactions: list[dict]) -> str:
-        importable = StringIO()
-        writer = csv.DictWriter(
-            importable,
+    def _csv_writer(self, stream):
+        return csv.DictWriter(
+            stream,
             fieldnames=self._CSV_FIELDNAMES,
             quoting=csv.QUOTE_ALL,
         )
+
+    def create_intermediary(self, transactions: list[dict]) -> str:
+        importable = StringIO()
+        writer = self._csv_writer(importable)
         writer.writeheader()
         writer.writerows(transactions)
         return importable.getvalue()
 
-    def create_transactions(self, transactions):
-        response = self._post(
-            files={
-                "importable": self.create_intermediary(transactions).encode("utf-8"),
-                "json": self._config_json.encode("utf-8"),
-            },
-            headers={
-                "Authorization": f"Bearer {self.config.personal_access_token}",
-                "Accept": "application/json",
-            },
-        )
+    def _encode_intermediary(self, transactions: list[dict]) -> bytes:
+        importable = BytesIO()
+        with TextIOWrapper(importable, encoding="utf-8", newline="") as wrapper:
+            writer = self._csv_writer(wrapper)
+            writer.writeheader()
+            writer.writerows(transactions)
+            wrapper.flush()
+            return importable.getvalue()
+
+    def _iter_intermediary(self, transactions: list[dict]):
+        buffer = StringIO()
+        writer = self._csv_writer(buffer)
+        writer.writeheader()
+        for rows in chunked(transactions, self._STREAM_CHUNK_ROWS):
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+        if remainder := buffer.getvalue():
+            yield remainder.encode("utf-8")
+
+    def _iter_multipart(self, transactions: list[dict], boundary: str):
+        # Mirrors the body requests builds for `files=`, row chunk by row chunk
+        yield (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="importable"; filename="importable"'
+            "\r\n\r\n"
+        ).encode("utf-8")
+        yield from self._iter_intermediary(transactions)
+        yield (
+            f"\r\n--{boundary}\r\n"
+            'Content-Disposition: form-data; name="json"; filename="json"\r\n\r\n'
+            f"{self._config_json}\r\n"
+            f"--{boundary}--\r\n"
+        ).encode("utf-8")
+
+    def _upload(self, transactions: list[dict]):
+        if self.config.stream_uploads:
+            boundary = uuid.uuid4().hex
+            response = self._post(
+                data=self._iter_multipart(transactions, boundary),
+                headers={
+                    "Content-Type": f"multipart/form-data; boundary={boundary}",
+                },
+            )
+        else:
+            response = self._post(
+                files={
+                    "importable": self._encode_intermediary(transactions),
+                    "json": self._config_json.encode("utf-8"),
+                },
+            )
+
         if not response.ok:
             logger.error(f"Failed creating transactions: \n\n{response.text}")
-            return [], []
+            return None
+
+        self.confirm_import_ids(
+            (t["external-id"], t["date_transaction"]) for t in transactions
+        )
+        return response.text
+
+    def _try_upload(self, transactions: list[dict]):
+        try:
+            return self._upload(transactions)
+        except requests.RequestException as exc:
+            logger.error(f"Failed uploading to FIDI: {exc}")
+            return None
+
+    async def _upload_async(self, client, transactions: list[dict]):
+        boundary = uuid.uuid4().hex
+        body = self._iter_multipart(transactions, boundary)
+        if self.config.stream_uploads:
+            content = _aiter(body)
+        else:
+            content = b"".join(body)
+
+        response = await client.post(
+            self._autoupload_url,
+            params={"secret": self.config.auto_import_secret},
+            content=content,
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        )
+        if not response.is_success:
+            logger.error(f"Failed creating transactions: \n\n{response.text}")
+            return None
+
+        self.confirm_import_ids(
+            (t["external-id"], t["date_transaction"]) for t in transactions
+        )
+        return response.text
+
+    def _split_uploads(self, transactions):
+        return list(
+            chunked(
+                transactions, self.config.rows_per_upload or max(len(transactions), 1)
+            )
+        )
+
+    def _handle_reports(self, reports):
+        for report in reports:
+            if report is None:
+                continue
 
-        report = response.text.splitlines()
-        logger.info("Received import report:")
-        for line in report:
-            if trimmed_line := line.strip():
-                logger.info(trimmed_line)
+            logger.info("Received import report:")
+            for line in report.splitlines():
+                if trimmed_line := line.strip():
+                    logger.info(trimmed_line)
 
+        if failed := reports.count(None):
+            raise UploadError(f"{failed} of {len(reports)} uploads to FIDI failed")
         return [], []
 
+    def create_transactions(self, transactions):
+        parts = self._split_uploads(list(transactions))
+
+        with ThreadPoolExecutor(
+            max_workers=self.config.max_parallel_uploads,
+            thread_name_prefix="fidi",
+        ) as pool:
+            reports = list(pool.map(self._try_upload, parts))
+
+        return self._handle_reports(reports)
+
+    async def create_transactions_async(self, transactions):
+        if httpx is None:
+            return await super().create_transactions_async(transactions)
+
+        parts = self._split_uploads(list(transactions))
+        slots = asyncio.Semaphore(self.config.max_parallel_uploads)
+
+        async def upload(client, part):
+            async with slots:
+                try:
+                    return await self._upload_async(client, part)
+                except httpx.HTTPError as exc:
+                    reason = str(exc) or type(exc).__name__
+                    logger.error(f"Failed uploading to FIDI: {reason}")
+                    return None
+
+        async with httpx.AsyncClient(
+            headers=self._headers,
+            limits=httpx.Limits(max_connections=self.config.max_parallel_uploads),
+            timeout=self.config.timeout,
+        ) as client:
+            reports = await asyncio.gather(*(upload(client, part) for part in parts))
+
+        return self._handle_reports(reports)
+
     def augment_transaction(
         self, transaction: FintsTransaction, account: AccountConfig
     ):
@@ -140,5 +309,10 @@ class FireFlyIIIApp(BaseApp):
         }
 
 
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
 Config = FireFlyIIIAppConfig
 App = FireFlyIIIApp
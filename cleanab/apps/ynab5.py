@@ -1,58 +1,291 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from uuid import UUID
 
-from pydantic import BaseModel
+import urllib3
+from logzero import logger
+from pydantic import AnyHttpUrl, BaseModel, confloat, conint
 from ynab_api.api_client import ApiClient
 from ynab_api.apis import AccountsApi, TransactionsApi
 from ynab_api.configuration import Configuration
+from ynab_api.exceptions import ApiException
 from ynab_api.model.save_transaction import SaveTransaction
 from ynab_api.model.save_transactions_wrapper import SaveTransactionsWrapper
 
 from ..models import AccountConfig, FintsTransaction
-from .base import BaseApp
+from ..utils import chunked
+from .base import BaseApp, UploadError
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
 
 API_URL = "https://api.youneedabudget.com/v1"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 
 class NewYnabConfig(BaseModel):
     access_token: str
     budget_id: UUID
+    api_url: AnyHttpUrl = API_URL
+
+    batch_size: conint(gt=0) = 250
+    max_parallel_batches: conint(gt=0) = 2
+    max_retries: conint(ge=0) = 5
+    # Seconds to wait for a response, a timed out request is retried
+    timeout: confloat(gt=0) = 30.0
+    backoff_factor: confloat(ge=0) = 1.0
+    max_backoff: confloat(ge=0) = 60.0
+
+
+def parse_rate_limit(headers):
+    try:
+        used, limit = headers["X-Rate-Limit"].split("/")
+        return int(limit) - int(used)
+    except (TypeError, KeyError, ValueError):
+        return None
 
 
 class NewYnabApp(BaseApp):
     def __init__(self, config) -> None:
+        self._config = config
         self._access_token = config.access_token
         self._budget_id = str(config.budget_id)
         self._api_client = self._create_ynab_api_client(self._access_token)
+        self._rate_limit_remaining = None
+        self._account_balances = {}
+        self._accounts_knowledge = None
 
     def __str__(self):
         return f"YNAB Budget {self._budget_id}"
 
     def _create_ynab_api_client(self, access_token):
         ynab_conf = Configuration(
-            host=API_URL,
+            host=self._config.api_url.rstrip("/"),
         )
         ynab_conf.api_key["bearer"] = access_token
         ynab_conf.api_key_prefix["bearer"] = "Bearer"
+        ynab_conf.connection_pool_maxsize = self._config.max_parallel_batches
         return ApiClient(ynab_conf)
 
+    def _retry_delay(self, attempt, headers):
+        try:
+            return min(float(headers["Retry-After"]), self._config.max_backoff)
+        except (TypeError, KeyError, ValueError):
+            pass
+        return min(self._config.backoff_factor * 2**attempt, self._config.max_backoff)
+
+    def _submit_batch(self, batch):
+        if self._rate_limit_remaining is not None and self._rate_limit_remaining < 1:
+            raise UploadError("YNAB rate limit exhausted")
+
+        api = TransactionsApi(self._api_client)
+        for attempt in range(self._config.max_retries + 1):
+            try:
+                result, _, headers = api.create_transaction(
+                    self._budget_id,
+                    SaveTransactionsWrapper(transactions=batch),
+                    _return_http_data_only=False,
+                    _request_timeout=self._config.timeout,
+                )
+            except (ApiException, urllib3.exceptions.HTTPError) as exc:
+                status = getattr(exc, "status", None)
+                retryable = status is None or status in RETRY_STATUSES
+                if not retryable or attempt == self._config.max_retries:
+                    raise
+
+                delay = self._retry_delay(attempt, getattr(exc, "headers", None))
+                logger.warning(
+                    f"Batch of {len(batch)} failed ({status or exc}),"
+                    f" retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                continue
+
+            remaining = parse_rate_limit(headers)
+            if remaining is not None:
+                self._rate_limit_remaining = remaining
+            self.confirm_import_ids((t.import_id, t.date) for t in batch)
+            duplicates = getattr(result.data, "duplicate_import_ids", [])
+            new = getattr(result.data, "transaction_ids", [])
+            return new, duplicates
+
+    def _try_submit_batch(self, batch):
+        try:
+            return self._submit_batch(batch)
+        except Exception as exc:
+            logger.error(f"Failed creating batch of {len(batch)} transactions: {exc}")
+            return None
+
+    async def _submit_batch_async(self, client, batch):
+        if self._rate_limit_remaining is not None and self._rate_limit_remaining < 1:
+            raise UploadError("YNAB rate limit exhausted")
+
+        body = self._api_client.sanitize_for_serialization(
+            SaveTransactionsWrapper(transactions=batch)
+        )
+        for attempt in range(self._config.max_retries + 1):
+            try:
+                response = await client.post(
+                    f"/budgets/{self._budget_id}/transactions", json=body
+                )
+                response.raise_for_status()
+            except httpx.HTTPError as exc:
+                response = getattr(exc, "response", None)
+                status = None if response is None else response.status_code
+                retryable = status is None or status in RETRY_STATUSES
+                if not retryable or attempt == self._config.max_retries:
+                    raise
+
+                delay = self._retry_delay(
+                    attempt, None if response is None else response.headers
+                )
+                # Timeouts of httpx come without a message
+                reason = status or str(exc) or type(exc).__name__
+                logger.warning(
+                    f"Batch of {len(batch)} failed ({reason}), retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            remaining = parse_rate_limit(response.headers)
+            if remaining is not None:
+                self._rate_limit_remaining = remaining
+            self.confirm_import_ids((t.import_id, t.date) for t in batch)
+            data = response.json()["data"]
+            return (
+                data.get("transaction_ids") or [],
+                data.get("duplicate_import_ids") or [],
+            )
+
+    def _async_client(self):
+        return httpx.AsyncClient(
+            base_url=self._config.api_url.rstrip("/"),
+            headers={"Authorization": f"Bearer {self._access_token}"},
+            limits=httpx.Limits(max_connections=self._config.max_parallel_batches),
+            timeout=self._config.timeout,
+        )
+
+    def _collect_results(self, results):
+        new, duplicates, failed = [], [], 0
+        for result in results:
+            if result is None:
+                failed += 1
+                continue
+            new += result[0]
+            duplicates += result[1]
+
+        if failed:
+            raise UploadError(
+                f"{failed} of {len(results)} batches failed",
+                new=new,
+                duplicates=duplicates,
+            )
+        return new, duplicates
+
     def create_transactions(self, transactions):
+        # The hourly limit renews, so only batches of this upload are held back
+        self._rate_limit_remaining = None
+        transactions = list(transactions)
+        batches = list(chunked(transactions, self._config.batch_size))
+        logger.debug(
+            f"Submitting {len(transactions)} transactions in {len(batches)} batches"
+        )
+
+        with ThreadPoolExecutor(
+            max_workers=self._config.max_parallel_batches,
+            thread_name_prefix="ynab",
+        ) as pool:
+            results = list(pool.map(self._try_submit_batch, batches))
+
+        return self._collect_results(results)
+
+    async def create_transactions_async(self, transactions):
+        if httpx is None:
+            return await super().create_transactions_async(transactions)
+
+        self._rate_limit_remaining = None
+        transactions = list(transactions)
+        batches = list(chunked(transactions, self._config.batch_size))
+        logger.debug(
+            f"Submitting {len(transactions)} transactions in {len(batches)} batches"
+        )
+
+        slots = asyncio.Semaphore(self._config.max_parallel_batches)
+
+        async def try_submit_batch(client, batch):
+            async with slots:
+                try:
+                    return await self._submit_batch_async(client, batch)
+                except Exception as exc:
+                    logger.error(
+                        f"Failed creating batch of {len(batch)} transactions: {exc}"
+                    )
+                    return None
+
+        async with self._async_client() as client:
+            results = await asyncio.gather(
+                *(try_submit_batch(client, batch) for batch in batches)
+            )
+
+        return self._collect_results(results)
+
+    def fetch_import_ids(self, since_date):
         api = TransactionsApi(self._api_client)
-        result = api.create_transaction(
+        result = api.get_transactions(
             self._budget_id,
-            SaveTransactionsWrapper(transactions=transactions),
+            since_date=since_date,
+            _request_timeout=self._config.timeout,
         )
-        duplicates = getattr(result.data, "duplicate_import_ids", [])
-        new = getattr(result.data, "transaction_ids", [])
+        return [
+            (t.import_id, t.date)
+            for t in result.data.transactions
+            if getattr(t, "import_id", None)
+        ]
 
-        return new, duplicates
+    def _update_balances(self, accounts, server_knowledge):
+        # Only accounts changed since the last request are sent again
+        for account_id, balance, deleted in accounts:
+            if deleted:
+                self._account_balances.pop(account_id, None)
+            else:
+                self._account_balances[account_id] = balance
+        self._accounts_knowledge = server_knowledge
+        return dict(self._account_balances)
 
-    def get_account_balance(self, account_id):
+    def _accounts_params(self):
+        if self._accounts_knowledge is None:
+            return {}
+        return {"last_knowledge_of_server": self._accounts_knowledge}
+
+    def get_account_balances(self):
         api = AccountsApi(self._api_client)
-        account = api.get_account_by_id(
-            account_id=account_id,
-            budget_id=self._budget_id,
+        result = api.get_accounts(
+            self._budget_id,
+            _request_timeout=self._config.timeout,
+            **self._accounts_params(),
+        )
+        return self._update_balances(
+            ((a.id, a.balance, a.deleted) for a in result.data.accounts),
+            result.data.server_knowledge,
+        )
+
+    async def get_account_balances_async(self):
+        if httpx is None:
+            return await super().get_account_balances_async()
+
+        async with self._async_client() as client:
+            response = await client.get(
+                f"/budgets/{self._budget_id}/accounts", params=self._accounts_params()
+            )
+            response.raise_for_status()
+        data = response.json()["data"]
+        return self._update_balances(
+            ((a["id"], a["balance"], a["deleted"]) for a in data["accounts"]),
+            data["server_knowledge"],
         )
-        return account.data.account.balance
 
     def augment_transaction(
         self, transaction: FintsTransaction, account: AccountConfig
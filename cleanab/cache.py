@@ -0,0 +1,100 @@
+import json
+from collections import OrderedDict
+
+from logzero import logger
+
+from .utils import write_atomic
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def merge(self, entries, hits, misses):
+        """Add the entries and counts collected by a `WorkerCache`."""
+        for key, value in entries:
+            self[key] = value
+        self.hits += hits
+        self.misses += misses
+
+
+class WorkerCache(LRUCache):
+    """Copy of a cache sent to a worker process, recording what it adds."""
+
+    def __init__(self, cache):
+        super().__init__(cache.maxsize)
+        self._data = cache._data.copy()
+        self._added = []
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._added.append((key, value))
+
+    def collect(self):
+        """Entries added, hits and misses since the previous call."""
+        collected = self._added, self.hits, self.misses
+        self._added, self.hits, self.misses = [], 0, 0
+        return collected
+
+
+class CleaningCache(LRUCache):
+    """Cleaned field values keyed by (rule-set fingerprint, raw value).
+
+    Entries of rule sets that are no longer configured are dropped on load, so
+    changing a replacement or finalizer invalidates exactly the affected fields.
+    """
+
+    def __init__(self, maxsize, path=None):
+        super().__init__(maxsize)
+        self.path = path
+
+    def load(self, fingerprints):
+        if not self.path or not self.path.is_file():
+            return
+
+        fingerprints = set(fingerprints)
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except ValueError:
+            logger.warning(f"Ignoring unreadable cleaning cache at {self.path}")
+            return
+
+        for fingerprint, raw, cleaned in entries:
+            if fingerprint not in fingerprints:
+                continue
+            if isinstance(cleaned, list):
+                cleaned = tuple(cleaned)
+            self[(fingerprint, raw)] = cleaned
+        logger.debug(f"Loaded {len(self)} cleaned values from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+
+        # dumps() uses the C encoder, dump() would encode in Python
+        data = json.dumps([[*key, value] for key, value in self._data.items()])
+        write_atomic(self.path, data.encode())
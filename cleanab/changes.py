@@ -0,0 +1,47 @@
+import json
+from collections import Counter, namedtuple
+
+from logzero import logger
+
+Change = namedtuple("Change", ["import_id", "field", "before", "after"])
+
+
+class ChangeReport:
+    """Collects the changes cleaning made, for a summary or a JSONL export."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.changes = []
+
+    def compare(self, original, cleaned, *, fields, import_id):
+        for field in fields:
+            before = original.get(field) or ""
+            after = cleaned.get(field) or ""
+            if before != after:
+                self.changes.append(Change(import_id, field, before, after))
+
+    def summarize(self):
+        if not self.changes:
+            logger.info("Cleaning changed no fields")
+            return
+
+        counts = Counter(
+            (change.field, change.before, change.after) for change in self.changes
+        )
+        transactions = len({change.import_id for change in self.changes})
+        lines = [
+            f"Cleaning changed {len(self.changes)} fields"
+            f" in {transactions} transactions:"
+        ]
+        for (field, before, after), count in counts.most_common():
+            lines.append(f"{count:6d}x {field:>16} {before!r} => {after!r}")
+        logger.info("\n".join(lines))
+
+    def write(self):
+        if not self.path:
+            return
+
+        with open(self.path, "w") as f:
+            for change in self.changes:
+                f.write(json.dumps(change._asdict()) + "\n")
+        logger.info(f"Wrote {len(self.changes)} changes to {self.path}")
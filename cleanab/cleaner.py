@@ -1,40 +1,62 @@
+import json
 import re
+from hashlib import sha256
 
 from logzero import logger
 
 from . import utils
+from .cache import WorkerCache
 from .constants import FIELDS_TO_CLEAN_UP
 from .models.cleaner import ReplacementDefinition
 
+# Maximum number of consecutive rules sharing a single combined pre-check
+RULE_GROUP_SIZE = 8
+
 
 class FieldCleaner:
     cleaners = None
     finalizers = None
     fields = FIELDS_TO_CLEAN_UP
 
-    def __init__(self, replacements, finalizing):
+    def __init__(self, replacements, finalizing, sequential=False, cache=None):
         self.cleaners = {}
         self.finalizers = {}
+        self.cache = cache
+        self.fingerprints = {}
+        self.finalizer_fingerprints = {}
 
         for field, contents in replacements:
             logger.info(f"Compiling replacements for {field}")
-            self.cleaners[field] = self.compile_cleaners(contents)
+            self.cleaners[field] = self.compile_cleaners(
+                contents, sequential=sequential
+            )
+            self.fingerprints[field] = self.fingerprint(field, contents)
 
         for field, contents in finalizing:
             self.finalizers[field] = self.compile_finalizer(contents)
+            self.finalizer_fingerprints[field] = self.fingerprint(
+                "finalizer", field, contents
+            )
 
-    @staticmethod
-    def compile_finalizer(config):
-        def finalizer(string):
-            if config.capitalize:
-                string = utils.capitalize_string(string)
+    def __getstate__(self):
+        # Copies sent to worker processes hand their new entries back per chunk
+        state = self.__dict__.copy()
+        if self.cache is not None:
+            state["cache"] = WorkerCache(self.cache)
+        return state
 
-            if config.strip:
-                string = string.strip()
+    @staticmethod
+    def fingerprint(*parts):
+        serialized = json.dumps(parts, sort_keys=True, default=lambda o: o.dict())
+        return sha256(serialized.encode("utf-8")).hexdigest()[:16]
 
-            return string
+    @property
+    def all_fingerprints(self):
+        return [*self.fingerprints.values(), *self.finalizer_fingerprints.values()]
 
-        return finalizer
+    @staticmethod
+    def compile_finalizer(config):
+        return utils.Finalizer(config)
 
     @staticmethod
     def compile_single_cleaner(entry):
@@ -47,14 +69,58 @@ class FieldCleaner:
         raise ValueError(f"Invalid replacement definition: {entry!r}")
 
     @staticmethod
-    def compile_cleaners(entries):
-        cleaners = []
+    def flatten_entries(entries):
         for entry in entries:
             if isinstance(entry, list):
-                cleaners += FieldCleaner.compile_cleaners(entry)
+                yield from FieldCleaner.flatten_entries(entry)
             else:
+                yield entry
+
+    @staticmethod
+    def compile_group(entries, patterns):
+        cleaners = [FieldCleaner.compile_single_cleaner(entry) for entry in entries]
+        if len(cleaners) == 1:
+            return cleaners[0]
+        return utils.rule_group_instance(patterns, cleaners)
+
+    @staticmethod
+    def compile_cleaners(entries, sequential=False):
+        entries = list(FieldCleaner.flatten_entries(entries))
+        if sequential:
+            return [FieldCleaner.compile_single_cleaner(entry) for entry in entries]
+
+        cleaners, literals = [], []
+        group, patterns = [], []
+        for entry in entries:
+            # Rules with a required literal are looked up in a literal index,
+            # the others are combined into groups sharing a pre-check if possible.
+            literal = utils.required_literal(entry)
+            pattern = None if literal else utils.gate_pattern(entry)
+            if pattern is not None:
+                group.append(entry)
+                patterns.append(pattern)
+                if len(group) < RULE_GROUP_SIZE:
+                    continue
+
+            if group:
+                cleaners.append(FieldCleaner.compile_group(group, patterns))
+                literals.append(None)
+                group, patterns = [], []
+            if pattern is None:
                 cleaners.append(FieldCleaner.compile_single_cleaner(entry))
-        return cleaners
+                literals.append(literal)
+
+        if group:
+            cleaners.append(FieldCleaner.compile_group(group, patterns))
+            literals.append(None)
+
+        if not any(literals):
+            return cleaners
+        return [utils.PrefilteredRules(cleaners, literals)]
+
+    def instrument(self, profile):
+        for field, cleaners in self.cleaners.items():
+            self.cleaners[field] = profile.instrument(field, cleaners)
 
     def iter_valid_data_fields(self, data):
         for field in self.fields:
@@ -67,13 +133,31 @@ class FieldCleaner:
 
             yield field, value
 
+    def cached_clean_field(self, field, value):
+        if self.cache is None:
+            return self.clean_field(field, value)
+
+        key = (self.fingerprints.get(field), value)
+        if (result := self.cache.get(key)) is None:
+            result = self.cache[key] = self.clean_field(field, value)
+        return result
+
+    def finalize_field(self, field, value):
+        if self.cache is None:
+            return self.finalizers[field](value)
+
+        key = (self.finalizer_fingerprints[field], value)
+        if (result := self.cache.get(key)) is None:
+            result = self.cache[key] = self.finalizers[field](value)
+        return result
+
     def clean_field(self, field, cleaned):
         transformations = {}
         for cleaner in self.cleaners.get(field, []):
             before_cleaning = cleaned
             cleaned, local_transformations = cleaner(cleaned)
             if before_cleaning != cleaned:
-                logger.debug(f"Cleaned '{before_cleaning}' => '{cleaned}'")
+                logger.debug("Cleaned '%s' => '%s'", before_cleaning, cleaned)
             transformations.update(local_transformations)
 
         return cleaned, transformations
@@ -82,7 +166,9 @@ class FieldCleaner:
         transformations = {}
         try:
             for field, previous in self.iter_valid_data_fields(data):
-                cleaned, local_transformations = self.clean_field(field, previous)
+                cleaned, local_transformations = self.cached_clean_field(
+                    field, previous
+                )
                 transformations.update(local_transformations)
                 data[field] = cleaned
 
@@ -91,7 +177,7 @@ class FieldCleaner:
 
             for field, previous in self.iter_valid_data_fields(data):
                 if field in self.finalizers:
-                    data[field] = self.finalizers[field](previous)
+                    data[field] = self.finalize_field(field, previous)
         except re.error as exc:
             raise ValueError(f"Exception for pattern {exc.pattern}") from exc
 
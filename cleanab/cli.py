@@ -2,9 +2,8 @@ import logging
 
 import click
 import logzero
-import yaml
 
-from .models.config import Config
+from .config_cache import load_config
 
 logzero.__name__ = "fints"
 logzero.setup_logger(level=logging.ERROR)
@@ -15,11 +14,10 @@ from cleanab.main import Cleanab  # noqa: F401, E402
 class ConfigFile(click.File):
     def convert(self, value, param, ctx):
         value = super().convert(value, param, ctx)
-        value = yaml.safe_load(value)
-        return Config.parse_obj(value)
+        return load_config(value.read())
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option(
     "-n",
     "--dry-run",
@@ -41,11 +39,59 @@ class ConfigFile(click.File):
         " --verbose)"
     ),
 )
+@click.option(
+    "-o",
+    "--offline",
+    is_flag=True,
+    help=(
+        "Use the locally stored transaction data instead of querying the bank APIs."
+        " Every fetch from a bank is stored locally."
+    ),
+)
 @click.option(
     "-v",
     "--verbose",
     is_flag=True,
-    help="Show replacements made to the received data",
+    help="Show a summary of the replacements made to the received data",
+)
+@click.option(
+    "--changes-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write every change made by cleaning to this file as JSON lines.",
+)
+@click.option(
+    "--profile-rules",
+    is_flag=True,
+    help=(
+        "Measure calls, matches and time spent per replacement rule and show the"
+        " rules ranked by cost, followed by those that never matched."
+    ),
+)
+@click.option(
+    "--profile-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the per-rule measurements to this file as JSON (implies profiling).",
+)
+@click.option(
+    "-f",
+    "--full",
+    is_flag=True,
+    help=(
+        "Ignore the last synced date of each account and fetch the full timespan"
+        " given by earliest_date and maximum_days."
+    ),
+)
+@click.option(
+    "--import-index",
+    type=click.Choice(["use", "verify", "rebuild", "ignore"]),
+    default="use",
+    show_default=True,
+    help=(
+        "How to treat the local index of already uploaded transactions: skip"
+        " transactions found in it (use), first drop entries the budgeting app does"
+        " not know (verify), first replace it with the app's transactions"
+        " (rebuild), or upload everything (ignore)."
+    ),
 )
 @click.option(
     "-c",
@@ -57,7 +103,41 @@ class ConfigFile(click.File):
     help="Custom location of the config file.",
     metavar="configfile",
 )
-def cli(**kwargs):
+@click.pass_context
+def cli(ctx, **kwargs):
+    """Fetch, clean up and upload bank transactions.
+
+    Runs a single sync unless a command is given.
+    """
     c = Cleanab(**kwargs)
-    c.setup()
-    c.run()
+    ctx.call_on_close(c.close)
+    if ctx.invoked_subcommand is None:
+        c.setup()
+        c.run()
+    else:
+        ctx.obj = c
+
+
+@cli.command()
+@click.pass_obj
+def serve(cleanab):
+    """Keep running and sync each account on its own interval."""
+    from .daemon import Daemon
+
+    cleanab.setup()
+    daemon = Daemon(cleanab)
+    daemon.install_signal_handlers()
+    daemon.run()
+
+
+@cli.command()
+@click.pass_obj
+def replay(cleanab):
+    """Clean the stored transactions again and show those whose result changed.
+
+    Meant for editing the replacements: only fields whose rules changed since
+    the previous replay are cleaned again, nothing is fetched or uploaded.
+    """
+    from .replay import Replay
+
+    Replay(cleanab).run()
@@ -0,0 +1,75 @@
+import pickle
+from hashlib import sha256
+from importlib import metadata
+from pathlib import Path
+
+import yaml
+from logzero import logger
+
+from .models.config import Config
+from .utils import CACHE_HOME, write_atomic
+
+PACKAGE_DIR = Path(__file__).parent
+# Compiled configs kept around, e.g. for scripts alternating between configs
+KEEP_COMPILED = 8
+
+
+def cleanab_version():
+    try:
+        return metadata.version("cleanab")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def code_fingerprint():
+    # The version stays the same in a checkout, so account for changed code too
+    files = []
+    for path in sorted(PACKAGE_DIR.rglob("*.py")):
+        stat = path.stat()
+        files.append(
+            (str(path.relative_to(PACKAGE_DIR)), stat.st_mtime_ns, stat.st_size)
+        )
+    return repr(files)
+
+
+def cache_key(text):
+    digest = sha256()
+    for part in (cleanab_version(), code_fingerprint(), text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def save_compiled(path, config):
+    # The config holds bank and app credentials, so keep it private to the user
+    write_atomic(
+        path, pickle.dumps(config, protocol=pickle.HIGHEST_PROTOCOL), private=True
+    )
+
+    compiled = sorted(
+        path.parent.glob("*.pickle"), key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    for outdated in compiled[KEEP_COMPILED:]:
+        outdated.unlink(missing_ok=True)
+
+
+def load_config(text, cache_dir=None):
+    """Validated config with compiled cleaner, reused while text and code match."""
+    path = (cache_dir or CACHE_HOME / "compiled_configs") / f"{cache_key(text)}.pickle"
+    try:
+        with open(path, "rb") as f:
+            config = pickle.load(f)
+        logger.debug(f"Using compiled config {path}")
+        return config
+    except FileNotFoundError:
+        pass
+    except Exception as exc:
+        logger.warning(f"Ignoring unreadable compiled config {path}: {exc}")
+
+    config = Config.parse_obj(yaml.safe_load(text))
+    config.get_cleaner()
+    try:
+        save_compiled(path, config)
+    except Exception as exc:
+        logger.warning(f"Could not store compiled config: {exc}")
+    return config
@@ -0,0 +1,106 @@
+import random
+import signal
+import threading
+from time import monotonic
+
+from logzero import logger
+
+
+class Daemon:
+    """Sync each account on its own interval, keeping cleaner and clients warm.
+
+    Accounts of one bank login are scheduled together, so that they share a
+    dialog. Failing banks are retried with exponential backoff, a signal lets
+    the current cycle finish before shutting down.
+    """
+
+    def __init__(self, cleanab):
+        self.cleanab = cleanab
+        self.settings = cleanab.config.serve
+        self.accounts = list(cleanab.accounts)
+        self.logins = cleanab.accounts_by_login()
+        self.stop_event = threading.Event()
+
+        # Everything is due right away
+        now = monotonic()
+        self.due = {account: now for account in self.accounts}
+        self.failures = {}
+
+    def interval(self, account):
+        minutes = account.sync_interval_minutes or self.settings.interval_minutes
+        return minutes * 60
+
+    def jitter_factor(self):
+        jitter = self.settings.jitter
+        return random.uniform(1 - jitter, 1 + jitter)
+
+    def slack(self, account):
+        """How early an account may be synced along with its login."""
+        return self.interval(account) * self.settings.jitter
+
+    def backoff(self, failures):
+        minutes = min(
+            self.settings.interval_minutes * 2 ** (failures - 1),
+            self.settings.max_backoff_minutes,
+        )
+        return minutes * 60
+
+    def stop(self, signum=None, frame=None):
+        if signum is not None:
+            logger.info(f"Received {signal.Signals(signum).name}, stopping")
+        self.stop_event.set()
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+
+    def run_cycle(self, accounts):
+        self.cleanab.accounts = accounts
+        try:
+            self.cleanab.run()
+            failed = self.cleanab.failed_accounts
+        except Exception:
+            logger.exception("Sync failed")
+            failed = set(accounts)
+
+        failed_banks = {account.fints_blz for account in failed}
+        now = monotonic()
+        for bank in {account.fints_blz for account in accounts}:
+            if bank in failed_banks:
+                self.failures[bank] = self.failures.get(bank, 0) + 1
+            else:
+                self.failures.pop(bank, None)
+
+        # One factor per login keeps its accounts due at the same time
+        for login in self.cleanab.accounts_by_login():
+            factor = self.jitter_factor()
+            for account in login:
+                if account.fints_blz in failed_banks:
+                    delay = self.backoff(self.failures[account.fints_blz])
+                    logger.warning(f"Retrying {account} in {delay / 60:.1f} minutes")
+                else:
+                    delay = self.interval(account)
+                self.due[account] = now + delay * factor
+
+    def due_accounts(self, now):
+        """Accounts due now, with the others of their login due soon anyway."""
+        return [
+            account
+            for login in self.logins
+            if any(self.due[account] <= now for account in login)
+            for account in login
+            if self.due[account] - now <= self.slack(account)
+        ]
+
+    def run(self):
+        logger.info(f"Serving {len(self.accounts)} accounts")
+        while not self.stop_event.is_set():
+            now = monotonic()
+            if due := self.due_accounts(now):
+                self.run_cycle(due)
+                continue
+
+            wait = min(self.due.values()) - now
+            logger.debug(f"Next sync in {wait:.0f} seconds")
+            self.stop_event.wait(wait)
+        logger.info("Stopped serving")
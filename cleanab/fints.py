@@ -1,60 +1,148 @@
 from __future__ import annotations
 
+import pickle
+from contextlib import contextmanager
 from functools import lru_cache
-from multiprocessing import Lock
+from hashlib import sha256
+from threading import Lock
+from typing import TYPE_CHECKING
 
-from fints.client import FinTS3PinTanClient
 from logzero import logger
 
 from .models.enums import AccountType
+from .utils import CACHE_HOME, write_atomic
 
-lock = Lock()
+if TYPE_CHECKING:
+    from fints.client import FinTS3PinTanClient
+
+STATE_DIR = CACHE_HOME / "fints"
+
+_login_locks_guard = Lock()
+_login_locks: dict[tuple[str, str], Lock] = {}
+
+
+def get_login_lock(blz, username) -> Lock:
+    with _login_locks_guard:
+        return _login_locks.setdefault((blz, username), Lock())
 
 
 def retrieve_transactions(
     sepa_account, fints: FinTS3PinTanClient, *, start_date, end_date
 ):
-    with lock:
-        transactions = fints.get_transactions(
-            sepa_account, start_date=start_date, end_date=end_date
-        )
+    transactions = fints.get_transactions(
+        sepa_account, start_date=start_date, end_date=end_date
+    )
     return [t.data for t in transactions]
 
 
 def retrieve_holdings(sepa_account, fints: FinTS3PinTanClient):
-    with lock:
-        holdings = fints.get_holdings(sepa_account)
+    holdings = fints.get_holdings(sepa_account)
     return [{"total_value": h.total_value} for h in holdings]
 
 
-@lru_cache(maxsize=8)
-def get_fints_client(blz, username, password, endpoint):
-    logger.info("Retrieving SEPA accounts for %s from %s", username, endpoint)
-    fints = FinTS3PinTanClient(blz, username, password, endpoint)
-    with lock:
-        sepa_accounts = fints.get_sepa_accounts()
+class FintsLogin:
+    """Client of one bank login, resuming the state of previous runs.
 
-    return fints, sepa_accounts
+    The dialog parameters and the SEPA accounts are stored in CACHE_HOME, so
+    subsequent runs skip the synchronization unless the bank changed them.
+    """
 
+    def __init__(self, blz, username, password, endpoint):
+        # Importing python-fints takes most of a second, so only do so when needed
+        from fints.client import FinTS3PinTanClient
 
-def process_fints_account(account, earliest, latest) -> list:
-    fints, sepa_accounts = get_fints_client(
-        account.fints_blz,
-        account.fints_username,
-        account.fints_password,
-        account.fints_endpoint,
-    )
-    accounts = [acc for acc in sepa_accounts if acc.iban == account.iban]
-    if not accounts:
-        logger.error(f"Account for IBAN {account.iban} not found")
-        return []
-    sepa_account = accounts[0]
+        self.username = username
+        key = sha256(f"{blz}\0{username}".encode("utf-8")).hexdigest()[:32]
+        self.path = STATE_DIR / f"{key}.pickle"
+        state = self.load()
 
-    if account.account_type == AccountType.HOLDING:
-        transactions = retrieve_holdings(sepa_account, fints)
-    else:
-        transactions = retrieve_transactions(
-            sepa_account, fints, start_date=earliest, end_date=latest
+        self.client = None
+        if state.get("client"):
+            try:
+                self.client = FinTS3PinTanClient(
+                    blz, username, password, endpoint, from_data=state["client"]
+                )
+            except Exception as exc:
+                logger.warning(f"Ignoring stored client state of {username}: {exc}")
+        if self.client is None:
+            self.client = FinTS3PinTanClient(blz, username, password, endpoint)
+
+        self.sepa_accounts = state.get("sepa_accounts", {})
+        self.sepa_upd_version = state.get("upd_version")
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as exc:
+            logger.warning(f"Ignoring unreadable client state {self.path}: {exc}")
+        return {}
+
+    def save(self):
+        state = {
+            # Includes account numbers and names, hence the private file
+            "client": self.client.deconstruct(including_private=True),
+            "sepa_accounts": self.sepa_accounts,
+            "upd_version": self.sepa_upd_version,
+        }
+        try:
+            write_atomic(self.path, pickle.dumps(state), private=True)
+        except Exception as exc:
+            logger.warning(f"Could not store client state of {self.username}: {exc}")
+
+    def get_sepa_account(self, iban):
+        # A new user parameter version means the accounts may have changed
+        if self.sepa_upd_version != self.client.upd_version or (
+            iban not in self.sepa_accounts
+        ):
+            logger.info("Retrieving SEPA accounts for %s", self.username)
+            self.sepa_accounts = {
+                sepa_account.iban: sepa_account
+                for sepa_account in self.client.get_sepa_accounts()
+            }
+            self.sepa_upd_version = self.client.upd_version
+            self.save()
+        return self.sepa_accounts.get(iban)
+
+
+@lru_cache(maxsize=8)
+def get_fints_login(blz, username, password, endpoint):
+    return FintsLogin(blz, username, password, endpoint)
+
+
+@contextmanager
+def fints_dialog(account):
+    """Open a dialog of the account's login, shared by all fetches within it."""
+    # Dialogs of the same login must not interleave, different logins may run
+    # concurrently.
+    with get_login_lock(account.fints_blz, account.fints_username):
+        login = get_fints_login(
+            account.fints_blz,
+            account.fints_username,
+            account.fints_password,
+            account.fints_endpoint,
         )
+        with login.client:
+            yield login
+        # Keep parameters the bank sent during the dialog for the next run
+        login.save()
 
-    return transactions
+
+def process_fints_account(account, earliest, latest, login=None) -> list:
+    if login is None:
+        with fints_dialog(account) as login:
+            return process_fints_account(account, earliest, latest, login)
+
+    sepa_account = login.get_sepa_account(account.iban)
+    if sepa_account is None:
+        # Raising marks the account as failed, an empty result would count as
+        # synced
+        raise ValueError(f"Account for IBAN {account.iban} not found")
+
+    if account.account_type == AccountType.HOLDING:
+        return retrieve_holdings(sepa_account, login.client)
+    return retrieve_transactions(
+        sepa_account, login.client, start_date=earliest, end_date=latest
+    )
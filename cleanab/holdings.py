@@ -1,37 +1,35 @@
-from datetime import date
 from hashlib import md5
 
+from .models import FintsTransaction
 
-def process_holdings(account, holdings, api, budget_id, min_delta=0):
-    ynab_acc = api.get_account_by_id(account_id=account.per_app_id, budget_id=budget_id)
+PAYEE_NAME = "Value Adjustment"
 
-    entry_date = date.today()
-    entry_date = entry_date.strftime("%Y-%m-%d")
-    balance_holdings = round(sum([h["total_value"] for h in holdings]) * 1000)
-    balance_ynab = ynab_acc.data.account.balance
-    amount = balance_holdings - balance_ynab
 
-    if amount == 0 or amount < min_delta * 1000:
+def process_holdings(holdings, balance, entry_date, min_delta=0):
+    """Transaction adjusting the app's balance to the value of the holdings."""
+    balance_holdings = round(sum(h["total_value"] for h in holdings) * 1000)
+    amount = balance_holdings - balance
+
+    if amount == 0 or abs(amount) < min_delta * 1000:
         return None
 
     balance_in = balance_holdings / 1000
-    balance_out = balance_ynab / 1000
+    balance_out = balance / 1000
     amount_adj = amount / 1000
 
-    uuid = md5(
-        (entry_date + "Value Adjustment" + "" + str(amount)).encode("utf-8")
+    import_id = md5(
+        (entry_date.strftime("%Y-%m-%d") + PAYEE_NAME + "" + str(amount)).encode(
+            "utf-8"
+        )
     ).hexdigest()
 
-    yield {
-        "account_id": account.per_app_id,
-        "date": entry_date,
-        "amount": amount,
-        "payee_name": "Value Adjustment",
-        "memo": (
+    return FintsTransaction(
+        date=entry_date,
+        amount=amount,
+        applicant_name=PAYEE_NAME,
+        purpose=(
             "Adjusting account balance: "
             f"{balance_in:.2f} - {amount_adj:.2f} = {balance_out:.2f}"
         ),
-        "import_id": uuid,
-        "cleared": "cleared" if account.default_cleared else "uncleared",
-        "approved": account.default_approved,
-    }
+        import_id=import_id,
+    )
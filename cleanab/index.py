@@ -0,0 +1,68 @@
+import sqlite3
+from threading import Lock
+
+
+class ImportIdIndex:
+    """Import ids confirmed by a budgeting app, one scope per app and budget."""
+
+    def __init__(self, path, scope):
+        self.path = path
+        self.scope = scope
+        self._lock = Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS import_ids ("
+            " scope TEXT NOT NULL,"
+            " import_id TEXT NOT NULL,"
+            " date TEXT NOT NULL,"
+            " PRIMARY KEY (scope, import_id)"
+            ") WITHOUT ROWID"
+        )
+        self._known = {
+            import_id
+            for (import_id,) in self._db.execute(
+                "SELECT import_id FROM import_ids WHERE scope = ?", (scope,)
+            )
+        }
+
+    def __contains__(self, import_id):
+        return import_id in self._known
+
+    def __len__(self):
+        return len(self._known)
+
+    def add(self, entries):
+        """Record (import_id, date) pairs as confirmed."""
+        rows = [(self.scope, import_id, str(date)) for import_id, date in entries]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO import_ids VALUES (?, ?, ?)", rows
+            )
+            self._known.update(row[1] for row in rows)
+
+    def verify(self, server_ids, since):
+        """Forget ids from `since` onwards that the server does not know."""
+        server_ids = set(server_ids)
+        with self._lock, self._db:
+            stale = [
+                import_id
+                for (import_id,) in self._db.execute(
+                    "SELECT import_id FROM import_ids WHERE scope = ? AND date >= ?",
+                    (self.scope, str(since)),
+                )
+                if import_id not in server_ids
+            ]
+            self._db.executemany(
+                "DELETE FROM import_ids WHERE scope = ? AND import_id = ?",
+                [(self.scope, import_id) for import_id in stale],
+            )
+            self._known.difference_update(stale)
+        return stale
+
+    def rebuild(self, entries):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM import_ids WHERE scope = ?", (self.scope,))
+            self._known.clear()
+        self.add(entries)
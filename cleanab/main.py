@@ -1,133 +1,515 @@
+import asyncio
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import date, timedelta
-from itertools import chain
+from itertools import chain, repeat
+from multiprocessing import get_context
 
 from logzero import logger
 
-from .apps.base import BaseApp, load_app
-from .cleaner import FieldCleaner
-from .fints import process_fints_account
+from .cache import CleaningCache
+from .changes import ChangeReport
+from .fints import fints_dialog, process_fints_account
 from .holdings import process_holdings
-from .models import AccountConfig
+from .index import ImportIdIndex
 from .models.enums import AccountType
-from .transactions import process_transaction
+from .pipeline import Pipeline
+from .profiling import RuleProfile
+from .state import SyncState
+from .store import get_transaction_store
+from .targets import AppTarget
+from .transactions import init_worker, process_chunk, process_transaction
+from .utils import CACHE_HOME, chunked
 
-TODAY = date.today()
 
+async def gather(uploads):
+    await asyncio.gather(*uploads)
 
-class Cleanab:
-    app_connection: BaseApp
 
-    def __init__(self, *, config, dry_run=False, test=False, verbose=False):
+def latest_booking_date(raw_transactions, today):
+    return min(
+        today,
+        max(t.get("entry_date") or t["date"] for t in raw_transactions),
+    )
+
+
+class Cleanab:
+    def __init__(
+        self,
+        *,
+        config,
+        dry_run=False,
+        test=False,
+        verbose=False,
+        full=False,
+        import_index="use",
+        offline=False,
+        changes_file=None,
+        profile_rules=False,
+        profile_file=None,
+    ):
         self.config = config
         self.dry_run = dry_run
         self.test = test
         self.verbose = verbose
+        self.full = full
+        self.offline = offline
+        self.import_index_mode = import_index
 
         if self.test:
             self.dry_run = True
             self.verbose = True
 
-    def setup_app_connection(self):
-        App, Config = load_app(self.config.app_module)
-        config = Config.parse_obj(self.config.app_config)
-        self.app_connection = App(config)
+        self.change_report = None
+        if self.verbose or changes_file:
+            self.change_report = ChangeReport(changes_file)
 
-    def setup(self):
-        self.setup_app_connection()
+        self.profile_rules = profile_rules
+        self.rule_profile = None
+        if profile_rules or profile_file:
+            self.rule_profile = RuleProfile(profile_file)
 
         self.accounts = self.config.accounts
-        logger.debug("Creating field cleaner instance")
-        self.cleaner = FieldCleaner(
-            self.config.replacements,
-            self.config.finalizer,
+        self.cleaning_pool = None
+
+    def setup_targets(self):
+        self.targets = [AppTarget.from_config(app) for app in self.config.apps]
+
+    def setup_import_index(self, target):
+        if not self.config.cleanab.import_index or self.import_index_mode == "ignore":
+            return
+
+        target.import_index = ImportIdIndex(
+            CACHE_HOME / "import_ids.sqlite3",
+            scope=str(target.app),
         )
+        target.app.import_index = target.import_index
+
+        if self.import_index_mode in ("verify", "rebuild"):
+            self.sync_import_index(target)
+
+    def sync_import_index(self, target):
+        since = self.config.timespan.earliest_date
+        index = target.import_index
+        try:
+            server_ids = target.app.fetch_import_ids(since)
+        except NotImplementedError as exc:
+            logger.warning(f"Not checking the import index: {exc}")
+            return
+
+        if self.import_index_mode == "rebuild":
+            index.rebuild(server_ids)
+            logger.info(f"Rebuilt import index of {target} with {len(index)} ids")
+        else:
+            stale = index.verify((i for i, _ in server_ids), since)
+            logger.info(f"Removed {len(stale)} ids unknown to {target} from index")
+
+    def setup_cleaner(self, cleaning_cache=None):
+        logger.debug("Creating field cleaner instance")
+        # Profiling measures every cleaning, so neither cache nor delegate them
+        profiling = self.rule_profile is not None
+        self.cleaning_cache = None if profiling else cleaning_cache
+        self.cleaner = self.config.get_cleaner()
+        self.cleaner.cache = self.cleaning_cache
+        if self.cleaning_cache is not None:
+            self.cleaning_cache.load(self.cleaner.all_fingerprints)
+        if profiling:
+            self.cleaner.instrument(self.rule_profile)
+
+    def setup_store(self):
+        logger.debug("Opening transaction store")
+        store = get_transaction_store()
+        # Before anything reads the store, so offline runs find older caches too
+        for account in self.accounts:
+            account.import_legacy_cache()
+        return store
+
+    def setup(self):
+        self.setup_store()
+        self.setup_targets()
+        for target in self.targets:
+            self.setup_import_index(target)
+
+        cleaning_cache = None
+        if cache_size := self.config.cleanab.cleaning_cache_size:
+            cleaning_cache = CleaningCache(
+                cache_size,
+                path=(
+                    CACHE_HOME / "cleaned_values.json"
+                    if self.config.cleanab.persist_cleaning_cache
+                    else None
+                ),
+            )
+        self.setup_cleaner(cleaning_cache)
+
+        profiling = self.rule_profile is not None
+        if (processes := self.config.cleanab.cleaning_processes) > 1 and not profiling:
+            self.cleaning_pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=get_context("spawn"),
+                initializer=init_worker,
+                initargs=(self.cleaner, logger.level),
+            )
+
+        self.sync_state = SyncState()
 
+    def start_run(self):
+        self.today = date.today()
         self.earliest = max(
             [
-                TODAY - timedelta(days=self.config.timespan.maximum_days),
+                self.today - timedelta(days=self.config.timespan.maximum_days),
                 self.config.timespan.earliest_date,
             ]
         )
         logger.info(f"Checking back until {self.earliest}")
 
-    def _get_fints_transactions(self, account):
-        if self.test and account.has_account_cache:
-            raw_transactions = account.read_account_cache()
+        self.synced_dates = {}
+        self.failed_accounts = set()
+        # Accounts with a window that was not processed; later windows must not
+        # mark it as synced
+        self.incomplete_accounts = set()
+        # Decided once per run, as fetched windows are stored while it goes on
+        self.cached_accounts = {
+            account for account in self.accounts if self.uses_account_cache(account)
+        }
+        for target in self.targets:
+            target.reset()
+        if self.change_report is not None:
+            self.change_report = ChangeReport(self.change_report.path)
+
+    def earliest_for(self, account):
+        if self.full:
+            return self.earliest
+
+        last_synced = self.sync_state.get(account.iban)
+        if last_synced is None:
+            return self.earliest
+
+        overlap = timedelta(days=self.config.timespan.overlap_days)
+        return max(self.earliest, last_synced - overlap)
+
+    def uses_account_cache(self, account):
+        return self.offline or (self.test and account.has_account_cache)
+
+    def fetch_windows(self, account):
+        """Split the timespan to fetch into windows of ``window_days`` each."""
+        earliest = self.earliest_for(account)
+        if account.account_type == AccountType.HOLDING:
+            # Holdings are a snapshot, not a history
+            yield earliest, self.today
+            return
+
+        window = timedelta(days=self.config.timespan.window_days)
+        while earliest + window <= self.today:
+            yield earliest, earliest + window - timedelta(days=1)
+            earliest += window
+        yield earliest, self.today
+
+    def _get_fints_transactions(self, account, earliest, latest, login=None):
+        if account in self.cached_accounts:
+            raw_transactions = account.read_account_cache(earliest, latest)
+            logger.info(f"Read {len(raw_transactions)} stored records of {account}")
         else:
+            logger.info(f"Requesting {account} from {earliest} to {latest}")
             raw_transactions = process_fints_account(
                 account,
-                earliest=self.earliest,
-                latest=TODAY,
+                earliest=earliest,
+                latest=latest,
+                login=login,
             )
             account.write_account_cache(raw_transactions)
         return raw_transactions
 
-    def processor(self, account):
+    def _fetch_window(self, account, earliest, latest, login=None):
+        try:
+            return self._get_fints_transactions(account, earliest, latest, login)
+        except Exception:
+            logger.exception("Fetching %s failed", account)
+            self.failed_accounts.add(account)
+
+            return None
+
+    def accounts_by_login(self):
+        logins = {}
+        for account in self.accounts:
+            key = (account.fints_blz, account.fints_username)
+            logins.setdefault(key, []).append(account)
+        return list(logins.values())
+
+    def iter_login(self, accounts, windows_per_dialog=None, stop=None):
+        """Fetch the windows of one bank login's accounts within a dialog.
+
+        Fetched windows are only handed on once the dialog has ended, so a slow
+        consumer never keeps the bank waiting. With ``windows_per_dialog``,
+        further windows are fetched in a new dialog. Windows of a failed
+        account carry `None`, its remaining windows are left for the next run,
+        as are all remaining windows once the ``stop`` event is set.
+        """
+        pending = deque(
+            (account, window)
+            for account in accounts
+            for window in self.fetch_windows(account)
+        )
+        while pending and not (stop and stop.is_set()):
+            fetched = []
+            online = [
+                account for account, _ in pending if account not in self.cached_accounts
+            ]
+            try:
+                with fints_dialog(online[0]) if online else nullcontext() as login:
+                    while pending and len(fetched) != windows_per_dialog:
+                        if stop and stop.is_set():
+                            break
+                        account, (earliest, latest) = pending.popleft()
+                        raw_transactions = self._fetch_window(
+                            account, earliest, latest, login
+                        )
+                        fetched.append((account, raw_transactions, latest))
+                        if raw_transactions is None:
+                            # Later windows would leave a gap in the history
+                            pending = deque(p for p in pending if p[0] != account)
+            except Exception:
+                logger.exception("Dialog with the bank of %s failed", accounts[0])
+                failed = list(dict.fromkeys(account for account, _ in pending))
+                self.failed_accounts.update(failed)
+                fetched.extend((account, None, None) for account in failed)
+                pending.clear()
+            yield from fetched
+
+    def fetch(self):
+        # Network-bound, so fetch logins concurrently but hand the results on in
+        # the configured order, one entry per window. Failed accounts carry
+        # `None` instead of transactions.
+        with ThreadPoolExecutor(
+            max_workers=self.config.cleanab.concurrency,
+            thread_name_prefix="fetch",
+        ) as pool:
+            logins = pool.map(list, map(self.iter_login, self.accounts_by_login()))
+            fetched = defaultdict(list)
+            for account, raw_transactions, latest in chain.from_iterable(logins):
+                fetched[account].append((account, raw_transactions, latest))
+        return list(chain.from_iterable(fetched[account] for account in self.accounts))
+
+    def synced_date(self, raw_transactions, latest):
+        if latest < self.today:
+            # A window in the past is complete, even without transactions
+            return latest
+        if raw_transactions:
+            return latest_booking_date(raw_transactions, latest)
+        return None
+
+    def iter_processed(self, account, raw_transactions, latest):
         logger.info(f"Processing {account}")
 
+        if account.account_type == AccountType.HOLDING:
+            # Turned into an adjustment per app, as it depends on the app's balance
+            yield from raw_transactions
+            return
+
+        for transaction in self.clean_transactions(raw_transactions):
+            if transaction:
+                yield transaction
+        if account in self.incomplete_accounts:
+            return
+        if synced := self.synced_date(raw_transactions, latest):
+            previous = self.synced_dates.get(account.iban, synced)
+            self.synced_dates[account.iban] = max(previous, synced)
+
+    async def augment(self, target, account, transactions):
+        app_account = target.account_for(account)
+        if account.account_type == AccountType.HOLDING:
+            transactions = await self.holdings_adjustment(
+                target, app_account, transactions
+            )
+
+        augmented, known = [], 0
+        for transaction in transactions:
+            if target.is_known(transaction.import_id):
+                known += 1
+                continue
+            augmented.append(target.app.augment_transaction(transaction, app_account))
+
+        if known:
+            logger.info(f"Skipped {known} transactions uploaded to {target} before")
+        return augmented
+
+    async def holdings_adjustment(self, target, account, holdings):
         try:
-            raw_transactions = self._get_fints_transactions(account)
-
-            if account.account_type == AccountType.HOLDING:
-                return []
-                processed_transactions = list(
-                    process_holdings(
-                        account,
-                        raw_transactions,
-                        self.accounts_api,
-                        self.budget_id,
-                        min_delta=self.config.cleanab.minimum_holdings_delta,
-                    )
-                )
-            else:
-                processed_transactions = list(
-                    self.process_account_transactions(
-                        raw_transactions,
-                        account,
-                    )
-                )
-            logger.info(f"Got {len(processed_transactions)} new transactions")
+            balance = await target.get_balance(account)
+        except NotImplementedError as exc:
+            logger.warning(f"Not syncing holdings: {exc}")
+            return []
+
+        adjustment = process_holdings(
+            holdings,
+            balance,
+            self.today,
+            min_delta=self.config.cleanab.minimum_holdings_delta,
+        )
+        return [] if adjustment is None else [adjustment]
+
+    def processor(self, account, raw_transactions, latest):
+        if raw_transactions is None:
+            return []
+
+        try:
+            processed_transactions = list(
+                self.iter_processed(account, raw_transactions, latest)
+            )
+            logger.info(f"Got {len(processed_transactions)} transactions")
             return processed_transactions
         except Exception:
             logger.exception("Processing %s failed", account)
+            self.incomplete_accounts.add(account)
 
             return []
 
+    def backfilling(self):
+        return any(len(list(self.fetch_windows(a))) > 1 for a in self.accounts)
+
     def run(self):
-        processed_transactions = list(
-            chain.from_iterable(self.processor(account) for account in self.accounts)
-        )
+        self.start_run()
+        # Backfills stream window by window, saving progress after each batch
+        if self.config.cleanab.pipeline or self.backfilling():
+            return self.run_pipeline()
+        return self.run_batch()
 
-        if not processed_transactions:
+    def close(self):
+        if self.cleaning_pool is not None:
+            self.cleaning_pool.shutdown()
+
+    def run_batch(self):
+        processed = [
+            (account, transactions)
+            for account, raw_transactions, latest in self.fetch()
+            if (transactions := self.processor(account, raw_transactions, latest))
+        ]
+        self.report_cleaning_cache()
+        self.report_changes()
+        self.report_rule_profile()
+
+        if not processed:
             logger.warning("No transactions found")
             return
 
+        self.upload(processed)
         if self.dry_run:
-            logger.info("Dry-run, not creating transactions")
-            if intermediary := self.app_connection.create_intermediary(
-                processed_transactions
-            ):
-                logger.debug(f"Intermediary:\n\n{intermediary}\n\n")
+            return
+
+        self.report_uploads()
+        self.save_sync_state(exclude=self.failed_ibans())
+
+    def upload(self, processed):
+        """Augment (account, transactions) pairs for every app and upload them."""
+        asyncio.run(
+            gather(self.upload_to(target, processed) for target in self.targets)
+        )
+
+    async def upload_to(self, target, processed):
+        ibans = {account.iban for account, _ in processed}
+        transactions = []
+        for account, account_transactions in processed:
+            try:
+                transactions += await self.augment(
+                    target, account, account_transactions
+                )
+            except Exception:
+                logger.exception("Preparing %s for %s failed", account, target)
+                target.failed_ibans.add(account.iban)
 
+        if not transactions:
             return
+        if self.dry_run:
+            logger.info(f"Dry-run, not creating transactions in {target}")
+            if intermediary := target.app.create_intermediary(transactions):
+                logger.debug(f"Intermediary:\n\n{intermediary}\n\n")
+            return
+        await target.upload(transactions, ibans)
 
-        logger.info(f"Creating transactions in {self.app_connection}")
-        new, duplicates = self.app_connection.create_transactions(
-            processed_transactions
+    def run_pipeline(self):
+        pipeline = Pipeline(
+            self,
+            batch_size=self.config.cleanab.pipeline_batch_size,
+            queue_size=self.config.cleanab.pipeline_queue_size,
         )
+        pipeline.run()
+        self.report_cleaning_cache()
+        self.report_changes()
+        self.report_rule_profile()
 
-        logger.info(f"Created {len(new)} new transactions")
-        logger.info(f"Saw {len(duplicates)} duplicates")
+        if self.dry_run:
+            return
 
-    def process_account_transactions(self, transactions: list, account: AccountConfig):
-        for transaction in transactions:
-            if not transaction:
-                continue
+        self.report_uploads()
+        self.save_sync_state(exclude=self.failed_ibans())
 
-            processed_transaction = process_transaction(transaction, self.cleaner)
-            if not processed_transaction:
-                continue
+    def failed_ibans(self):
+        incomplete = {account.iban for account in self.incomplete_accounts}
+        return incomplete.union(*(target.failed_ibans for target in self.targets))
 
-            yield self.app_connection.augment_transaction(
-                processed_transaction, account
-            )
+    def checkpoint(self, synced):
+        """Save the (iban, date) pairs of windows uploaded to all apps."""
+        failed = self.failed_ibans()
+        for iban, last_date in synced:
+            if iban not in failed:
+                self.sync_state.update(iban, last_date)
+        self.sync_state.save()
+
+    def save_sync_state(self, exclude=()):
+        for iban, last_date in self.synced_dates.items():
+            if iban not in exclude:
+                self.sync_state.update(iban, last_date)
+        self.sync_state.save()
+
+    def report_uploads(self):
+        for target in self.targets:
+            logger.info(f"Created {len(target.new)} new transactions in {target}")
+            logger.info(f"Saw {len(target.duplicates)} duplicates in {target}")
+
+    def report_changes(self):
+        if self.change_report is None:
+            return
+
+        if self.verbose:
+            self.change_report.summarize()
+        self.change_report.write()
+
+    def report_rule_profile(self):
+        if self.rule_profile is None:
+            return
+
+        if self.profile_rules:
+            self.rule_profile.summarize()
+        self.rule_profile.write()
+
+    def report_cleaning_cache(self):
+        if self.cleaning_cache is None:
+            return
+
+        logger.info(
+            f"Cleaning cache: {self.cleaning_cache.hits} hits, "
+            f"{self.cleaning_cache.misses} misses"
+        )
+        self.cleaning_cache.save()
+
+    def clean_transactions(self, transactions):
+        transactions = [transaction for transaction in transactions if transaction]
+        chunk_size = self.config.cleanab.cleaning_chunk_size
+        if self.cleaning_pool is None or len(transactions) <= chunk_size:
+            for transaction in transactions:
+                yield process_transaction(transaction, self.cleaner, self.change_report)
+            return
+
+        # Chunks are cleaned in worker processes; map() keeps their order
+        results = self.cleaning_pool.map(
+            process_chunk,
+            chunked(transactions, chunk_size),
+            repeat(self.change_report is not None),
+        )
+        for processed, changes, cached in results:
+            if self.change_report is not None:
+                self.change_report.changes.extend(changes)
+            if cached is not None and self.cleaning_cache is not None:
+                self.cleaning_cache.merge(*cached)
+            yield from processed
@@ -1,7 +1,10 @@
 import pickle
+from typing import Dict, Optional
 
-from pydantic import BaseModel, HttpUrl, constr, validator
+from logzero import logger
+from pydantic import BaseModel, HttpUrl, confloat, constr, validator
 
+from ..store import get_transaction_store
 from ..utils import CACHE_HOME
 from ..validators import is_iban
 from .enums import AccountType
@@ -10,6 +13,8 @@ from .enums import AccountType
 class AccountConfig(BaseModel):
     iban: str
     per_app_id: str
+    # Ids in apps other than the first, by app name
+    per_app_ids: Dict[str, str] = {}
 
     fints_username: str
     fints_password: str
@@ -22,6 +27,9 @@ class AccountConfig(BaseModel):
     default_cleared: bool = False
     default_approved: bool = False
 
+    # Minutes between syncs when serving, defaults to serve.interval_minutes
+    sync_interval_minutes: Optional[confloat(gt=0)] = None
+
     def __hash__(self):
         return hash(self.iban + self.per_app_id)
 
@@ -35,12 +43,24 @@ class AccountConfig(BaseModel):
         return base + f" (…{self.iban[-4:]})"
 
     @property
-    def _account_cache_filename(self):
+    def _legacy_cache_filename(self):
         return CACHE_HOME / f"{self.iban}.pickle"
 
+    def import_legacy_cache(self):
+        """Move records of the pickle cache used before into the store."""
+        filename = self._legacy_cache_filename
+        if not filename.is_file():
+            return
+
+        with open(filename, "rb") as f:
+            transactions = pickle.load(f)
+        logger.info(f"Importing {len(transactions)} cached records of {self}")
+        self.write_account_cache(transactions)
+        filename.unlink()
+
     @property
     def has_account_cache(self):
-        return self._account_cache_filename.is_file()
+        return get_transaction_store().has(self.iban)
 
     @validator("iban")
     def iban_valid(cls, v):
@@ -49,10 +69,14 @@ class AccountConfig(BaseModel):
         return v
 
     def write_account_cache(self, transactions):
-        CACHE_HOME.mkdir(parents=True, exist_ok=True)
-        with open(self._account_cache_filename, "wb") as f:
-            pickle.dump(transactions, f)
+        store = get_transaction_store()
+        if self.account_type == AccountType.HOLDING:
+            store.add_snapshot(self.iban, transactions)
+        else:
+            store.add(self.iban, transactions)
 
-    def read_account_cache(self):
-        with open(self._account_cache_filename, "rb") as f:
-            return pickle.load(f)
+    def read_account_cache(self, earliest=None, latest=None):
+        store = get_transaction_store()
+        if self.account_type == AccountType.HOLDING:
+            return store.read_snapshot(self.iban)
+        return store.read(self.iban, earliest, latest)
@@ -1,7 +1,16 @@
 from datetime import date
 from typing import Any, List, Union
 
-from pydantic import BaseModel, Extra, confloat, conint, conlist
+from pydantic import (
+    BaseModel,
+    Extra,
+    PrivateAttr,
+    confloat,
+    conint,
+    conlist,
+    root_validator,
+    validator,
+)
 from pydantic.main import create_model
 
 from ..constants import FIELDS_TO_CLEAN_UP
@@ -12,12 +21,40 @@ from .cleaner import FinalizerDefinition, ReplacementDefinition
 class TimespanConfig(BaseModel):
     earliest_date = date(2000, 1, 1)
     maximum_days: conint(ge=1) = 30
+    overlap_days: conint(ge=0) = 3
+    window_days: conint(ge=1) = 90
 
 
 class CleanabConfig(BaseModel):
     concurrency: conint(gt=0) = 1
     minimum_holdings_delta: confloat(ge=0) = 1
     debug: bool = False
+    sequential_rules: bool = False
+    cleaning_cache_size: conint(ge=0) = 10000
+    persist_cleaning_cache: bool = False
+    import_index: bool = True
+    pipeline: bool = False
+    pipeline_batch_size: conint(gt=0) = 500
+    pipeline_queue_size: conint(gt=0) = 4
+    cleaning_processes: conint(gt=0) = 1
+    cleaning_chunk_size: conint(gt=0) = 2000
+
+
+class ServeConfig(BaseModel):
+    interval_minutes: confloat(gt=0) = 60
+    jitter: confloat(ge=0, le=1) = 0.1
+    max_backoff_minutes: confloat(gt=0) = 24 * 60
+
+
+class AppTargetConfig(BaseModel):
+    module: str = "cleanab.apps.ynab5"
+    config: Any
+    # Accounts may use a different per_app_id for each app, by this name
+    name: str = None
+
+    @validator("name", always=True)
+    def name_from_module(cls, v, values):
+        return v or values.get("module", "").rsplit(".", 1)[-1]
 
 
 NestedReplacementEntry = List[Union[ReplacementDefinition, str]]
@@ -31,28 +68,61 @@ FullReplacementEntry = List[
 
 ReplacementFields = create_model(
     "ReplacementFields",
-    **{field: (FullReplacementEntry, []) for field in FIELDS_TO_CLEAN_UP}
+    __module__=__name__,
+    **{field: (FullReplacementEntry, []) for field in FIELDS_TO_CLEAN_UP},
 )
 
 
 FinalizerFields = create_model(
     "FinalizerFields",
+    __module__=__name__,
     **{
         field: (FinalizerDefinition, FinalizerDefinition())
         for field in FIELDS_TO_CLEAN_UP
-    }
+    },
 )
 
 
 class Config(BaseModel):
     cleanab = CleanabConfig()
     timespan = TimespanConfig()
+    serve = ServeConfig()
     app_module: str = "cleanab.apps.ynab5"
-    app_config: Any
+    app_config: Any = None
+    apps: List[AppTargetConfig] = []
     accounts: conlist(AccountConfig, min_items=1)
     replacements = ReplacementFields()
     pre_replacements = ReplacementFields()
     finalizer = FinalizerFields()
 
+    _cleaner = PrivateAttr(None)
+
     class Config:
         extra = Extra.allow
+
+    @root_validator(skip_on_failure=True)
+    def single_app(cls, values):
+        if not values["apps"]:
+            if values["app_config"] is None:
+                raise ValueError("Either apps or app_config must be configured")
+            values["apps"] = [
+                AppTargetConfig(
+                    module=values["app_module"], config=values["app_config"]
+                )
+            ]
+
+        names = [app.name for app in values["apps"]]
+        if len(set(names)) < len(names):
+            raise ValueError(f"App names must be unique: {', '.join(names)}")
+        return values
+
+    def get_cleaner(self):
+        if self._cleaner is None:
+            from ..cleaner import FieldCleaner
+
+            self._cleaner = FieldCleaner(
+                self.replacements,
+                self.finalizer,
+                sequential=self.cleanab.sequential_rules,
+            )
+        return self._cleaner
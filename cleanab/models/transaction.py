@@ -1,15 +1,16 @@
 from datetime import date
+from typing import NamedTuple
 
-from pydantic import BaseModel, validator
 
+class FintsTransaction(NamedTuple):
+    """A cleaned transaction on its way to the budgeting app.
+
+    Built from already typed FinTS data, so it is a plain tuple rather than a
+    validated model; the app adapters validate what they send.
+    """
 
-class FintsTransaction(BaseModel):
     date: date
     amount: int
     applicant_name: str
     purpose: str = ""
     import_id: str = ""
-
-    @validator("purpose", pre=True)
-    def set_purpose_empty(cls, purpose):
-        return purpose or ""
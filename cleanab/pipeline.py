@@ -0,0 +1,115 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+
+from logzero import logger
+
+from .models.enums import AccountType
+
+_DONE = object()
+
+
+class Pipeline:
+    """Fetch, clean and upload concurrently, connected by bounded queues.
+
+    At most ``queue_size`` fetched windows and upload batches are held between
+    the stages, and as many windows per dialog with a bank, so memory use does
+    not grow with the number of transactions. The sync state is saved after
+    each batch, so an interrupted backfill resumes after the last window
+    uploaded.
+    """
+
+    def __init__(self, cleanab, batch_size, queue_size):
+        self.cleanab = cleanab
+        self.batch_size = batch_size
+        self.fetched = Queue(maxsize=queue_size)
+        self.batches = Queue(maxsize=queue_size)
+        # Set when cleaning stopped early, fetching then stops between windows
+        self.stopping = threading.Event()
+
+    def fetch(self):
+        with ThreadPoolExecutor(
+            max_workers=self.cleanab.config.cleanab.concurrency,
+            thread_name_prefix="fetch",
+        ) as pool:
+            for accounts in self.cleanab.accounts_by_login():
+                pool.submit(self._fetch_into_queue, accounts)
+        self.fetched.put(_DONE)
+
+    def _fetch_into_queue(self, accounts):
+        # Blocks on a full queue only between dialogs with the bank
+        for fetched in self.cleanab.iter_login(
+            accounts, windows_per_dialog=self.fetched.maxsize, stop=self.stopping
+        ):
+            if self.stopping.is_set():
+                return
+            self.fetched.put(fetched)
+
+    def clean(self):
+        # Batches carry the (iban, date) pairs of the windows completed in or
+        # before them, so the sync state advances as soon as they are uploaded
+        batch, synced, size = [], [], 0
+        for account, raw_transactions, latest in iter(self.fetched.get, _DONE):
+            if raw_transactions is None:
+                continue
+
+            # Holdings are adjusted as a whole against the app's balance, so
+            # they must not be split across batches
+            splittable = account.account_type != AccountType.HOLDING
+            transactions, count = [], 0
+            try:
+                for transaction in self.cleanab.iter_processed(
+                    account, raw_transactions, latest
+                ):
+                    transactions.append(transaction)
+                    count += 1
+                    size += 1
+                    if splittable and size >= self.batch_size:
+                        batch.append((account, transactions))
+                        self.batches.put((batch, synced))
+                        batch, synced, transactions, size = [], [], [], 0
+            except Exception:
+                logger.exception("Processing %s failed", account)
+                self.cleanab.incomplete_accounts.add(account)
+                continue
+            if transactions:
+                batch.append((account, transactions))
+            if last_date := self.cleanab.synced_dates.get(account.iban):
+                synced.append((account.iban, last_date))
+            logger.info(f"Got {count} transactions")
+
+        if batch or synced:
+            self.batches.put((batch, synced))
+
+    def upload(self):
+        for batch, synced in iter(self.batches.get, _DONE):
+            try:
+                if batch:
+                    self.cleanab.upload(batch)
+                if synced and not self.cleanab.dry_run:
+                    self.cleanab.checkpoint(synced)
+            except Exception:
+                logger.exception("Uploading a batch failed")
+                self.cleanab.incomplete_accounts.update(account for account, _ in batch)
+
+    def run(self):
+        fetcher = threading.Thread(target=self.fetch, name="pipeline-fetch")
+        uploader = threading.Thread(target=self.upload, name="pipeline-upload")
+        fetcher.start()
+        uploader.start()
+        cleaned = False
+        try:
+            self.clean()
+            cleaned = True
+        finally:
+            self.batches.put(_DONE)
+            if not cleaned:
+                self.stopping.set()
+                # Drop what is queued, unblocking fetch workers until they stopped
+                while fetcher.is_alive():
+                    try:
+                        self.fetched.get(timeout=0.1)
+                    except Empty:
+                        pass
+            fetcher.join()
+            uploader.join()
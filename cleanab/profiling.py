@@ -0,0 +1,125 @@
+import json
+from time import perf_counter
+
+from logzero import logger
+
+from .utils import PrefilteredRules, RegexSub, RuleGroup, SimpleReplace
+
+
+class RuleStats:
+    def __init__(self, field, index, kind, rule):
+        self.field = field
+        self.index = index
+        self.kind = kind
+        self.rule = rule
+        self.calls = 0
+        self.matches = 0
+        self.transforms = 0
+        self.seconds = 0.0
+        self.members = []
+
+    @property
+    def own_seconds(self):
+        # A group's own time is spent in its pre-check or literal lookups
+        return self.seconds - sum(member.seconds for member in self.members)
+
+    def asdict(self):
+        return {
+            "field": self.field,
+            "index": self.index,
+            "kind": self.kind,
+            "rule": self.rule,
+            "calls": self.calls,
+            "matches": self.matches,
+            "transforms": self.transforms,
+            "seconds": round(self.own_seconds, 6),
+        }
+
+
+class ProfiledRule:
+    def __init__(self, cleaner, stats):
+        self.cleaner = cleaner
+        self.stats = stats
+
+    def __call__(self, x):
+        start = perf_counter()
+        cleaned, transformed = self.cleaner(x)
+        stats = self.stats
+        stats.seconds += perf_counter() - start
+        stats.calls += 1
+        if transformed or cleaned != x:
+            stats.matches += 1
+        stats.transforms += len(transformed)
+        return cleaned, transformed
+
+
+def describe(cleaner):
+    if isinstance(cleaner, SimpleReplace):
+        return repr(cleaner.string)
+    if isinstance(cleaner, RegexSub):
+        return f"/{cleaner.entry.pattern}/ => {cleaner.entry.repl!r}"
+    return repr(cleaner)
+
+
+class RuleProfile:
+    """Calls, matches and time spent per replacement rule."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stats = []
+        self._counts = {}
+
+    def _add(self, field, kind, rule):
+        if kind == "rule":
+            self._counts[field] = self._counts.get(field, 0) + 1
+        stats = RuleStats(field, self._counts.get(field, 0), kind, rule)
+        self.stats.append(stats)
+        return stats
+
+    def instrument(self, field, cleaners):
+        instrumented = []
+        for cleaner in cleaners:
+            if isinstance(cleaner, (RuleGroup, PrefilteredRules)):
+                first = self._counts.get(field, 0) + 1
+                cleaner.cleaners = self.instrument(field, cleaner.cleaners)
+                last = self._counts[field]
+                if isinstance(cleaner, RuleGroup):
+                    stats = self._add(field, "group", f"pre-check of #{first}-#{last}")
+                else:
+                    stats = self._add(field, "index", f"literals of #{first}-#{last}")
+                stats.index = first
+                stats.members = [member.stats for member in cleaner.cleaners]
+            else:
+                stats = self._add(field, "rule", describe(cleaner))
+            instrumented.append(ProfiledRule(cleaner, stats))
+        return instrumented
+
+    def ranked(self):
+        return sorted(self.stats, key=lambda s: s.own_seconds, reverse=True)
+
+    def summarize(self):
+        lines = [
+            "Rule profile, most expensive first:",
+            f"{'ms':>9} {'calls':>8} {'matches':>8} {'transf.':>8}"
+            f" {'field':>16} {'#':>4}  rule",
+        ]
+        for stats in self.ranked():
+            lines.append(
+                f"{stats.own_seconds * 1000:9.2f} {stats.calls:8d} {stats.matches:8d}"
+                f" {stats.transforms:8d} {stats.field:>16} {stats.index:4d}"
+                f"  {stats.rule}"
+            )
+
+        dead = [s for s in self.stats if s.kind == "rule" and not s.matches]
+        if dead:
+            lines.append(f"{len(dead)} rules never matched:")
+            lines.extend(f"  {s.field} #{s.index}: {s.rule}" for s in dead)
+        logger.info("\n".join(lines))
+
+    def write(self):
+        if not self.path:
+            return
+
+        with open(self.path, "w") as f:
+            json.dump([stats.asdict() for stats in self.ranked()], f, indent=2)
+        logger.info(f"Wrote rule profile to {self.path}")
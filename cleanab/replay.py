@@ -0,0 +1,131 @@
+import json
+from collections import defaultdict
+from time import perf_counter
+
+import click
+from logzero import logger
+
+from .cache import CleaningCache
+from .models.enums import AccountType
+from .store import booking_date
+from .transactions import cleaned_fields, cleaning_input
+from .utils import CACHE_HOME, write_atomic
+
+# Years of history easily hold more distinct values than a regular run
+REPLAY_CACHE_SIZE = 1_000_000
+
+
+class Replay:
+    """Clean the stored history again, showing the results that changed.
+
+    Only records stored since the previous replay are read from the store.
+    Each distinct payee and purpose is cleaned once, and cleaned values are
+    kept by rule-set fingerprint. After editing the replacements, only the
+    fields of the edited rules are therefore cleaned again.
+    """
+
+    def __init__(self, cleanab):
+        self.cleanab = cleanab
+        self.inputs_path = CACHE_HOME / "replay_inputs.json"
+        self.outputs_path = CACHE_HOME / "replay_outputs.json"
+        self.cleaning_cache = CleaningCache(
+            REPLAY_CACHE_SIZE, path=CACHE_HOME / "replay_cleaned_values.json"
+        )
+
+    @staticmethod
+    def load(path, default):
+        if not path.is_file():
+            return default
+
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning(f"Ignoring unreadable replay data at {path}")
+            return default
+
+    def read_inputs(self):
+        """Booking date and cleaner input of each stored record, by IBAN."""
+        stored = self.load(self.inputs_path, {})
+        store = self.cleanab.setup_store()
+
+        inputs, added = {}, 0
+        for account in self.cleanab.accounts:
+            if account.account_type == AccountType.HOLDING:
+                continue
+
+            records = inputs[account.iban] = stored.get(account.iban, {})
+            new = store.hashes(account.iban).difference(records)
+            for content_hash, data in store.read_hashes(account.iban, new):
+                local_data = cleaning_input(data)
+                records[content_hash] = [
+                    booking_date(data).isoformat(),
+                    local_data["applicant_name"],
+                    local_data["purpose"],
+                ]
+            added += len(new)
+
+        if added or inputs.keys() != stored.keys():
+            write_atomic(self.inputs_path, json.dumps(inputs).encode())
+        return inputs
+
+    def echo_changed(self, before, after, dates):
+        first, last = min(dates), max(dates)
+        period = first if first == last else f"{first} to {last}"
+        click.echo(f"{len(dates)} transactions, {period}")
+        for field, previous, current in zip(("payee", "purpose"), before, after):
+            if previous != current:
+                click.echo(f"  {field}: {previous!r}")
+                click.echo(f"  {' ' * len(field)}  {current!r}")
+
+    def run(self):
+        start = perf_counter()
+        saved = self.load(self.outputs_path, {})
+        fingerprints = self.cleanab.config.get_cleaner().all_fingerprints
+        rules_changed = saved.get("fingerprints") != fingerprints
+        # Unchanged rules give the previous results, the cleaned values are only
+        # needed to clean after an edit
+        self.cleanab.setup_cleaner(self.cleaning_cache if rules_changed else None)
+        cleaner = self.cleanab.cleaner
+
+        by_input = defaultdict(list)
+        for records in self.read_inputs().values():
+            for entry_date, applicant_name, purpose in records.values():
+                by_input[applicant_name, purpose].append(entry_date)
+
+        previous = {
+            (applicant_name, purpose): tuple(output)
+            for applicant_name, purpose, output in saved.get("outputs", [])
+        }
+        outputs, changed = {}, 0
+        for key, dates in by_input.items():
+            before = previous.get(key)
+            if before is not None and not rules_changed:
+                outputs[key] = before
+                continue
+
+            applicant_name, purpose = key
+            local_data = cleaner.clean(
+                {"applicant_name": applicant_name, "purpose": purpose}
+            )
+            output = outputs[key] = cleaned_fields(local_data)
+            if before is not None and before != output:
+                changed += len(dates)
+                self.echo_changed(before, output, dates)
+
+        self.cleanab.report_rule_profile()
+        if self.cleaning_cache.misses:
+            self.cleaning_cache.save()
+        if rules_changed or outputs != previous:
+            results = {
+                "fingerprints": fingerprints,
+                "outputs": [[*key, output] for key, output in outputs.items()],
+            }
+            write_atomic(self.outputs_path, json.dumps(results).encode())
+
+        count = sum(map(len, by_input.values()))
+        if previous:
+            summary = f"{changed} of {count} transactions changed"
+        else:
+            summary = f"Recorded {count} transactions for the next replay"
+        logger.info(f"{summary} in {perf_counter() - start:.2f}s")
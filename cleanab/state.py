@@ -0,0 +1,33 @@
+import json
+from datetime import date
+
+from .utils import CACHE_HOME, write_atomic
+
+
+class SyncState:
+    """Last booking date successfully synced, per IBAN."""
+
+    def __init__(self, path=None):
+        self.path = path or CACHE_HOME / "sync_state.json"
+        self._dates = {}
+        if self.path.is_file():
+            with open(self.path) as f:
+                self._dates = {
+                    iban: date.fromisoformat(value)
+                    for iban, value in json.load(f).items()
+                }
+
+    def get(self, iban):
+        return self._dates.get(iban)
+
+    def update(self, iban, last_date):
+        current = self._dates.get(iban)
+        if current is None or last_date > current:
+            self._dates[iban] = last_date
+
+    def save(self):
+        data = json.dumps(
+            {iban: value.isoformat() for iban, value in self._dates.items()},
+            indent=2,
+        )
+        write_atomic(self.path, data.encode())
@@ -0,0 +1,168 @@
+import pickle
+import sqlite3
+from datetime import date, datetime
+from functools import lru_cache
+from hashlib import sha256
+from threading import Lock
+
+from logzero import logger
+
+from .utils import CACHE_HOME, chunked
+
+SCHEMA_VERSION = 1
+# Stays below SQLite's limit of host parameters per query
+QUERY_PARAMETERS = 500
+# Snapshot ids sort by the time they were taken, content hashes are hex digits
+SNAPSHOT_PREFIX = "snapshot:"
+
+
+def _canonical(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if hasattr(value, "amount") and hasattr(value, "currency"):
+        return f"{value.amount} {value.currency}"
+    return repr(value)
+
+
+def content_hash(data):
+    canonical = repr(sorted((key, _canonical(value)) for key, value in data.items()))
+    return sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def booking_date(data):
+    return data.get("entry_date") or data.get("date") or date.today()
+
+
+class TransactionStore:
+    """Append-only store of raw FinTS records, deduplicated by content.
+
+    Records are indexed by IBAN and booking date so date windows can be read
+    without unpickling the rest of the history.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            self._create_schema()
+        elif version != SCHEMA_VERSION:
+            raise ValueError(
+                f"Transaction store {path} has unsupported version {version}"
+            )
+
+    def _create_schema(self):
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS raw_transactions ("
+                " iban TEXT NOT NULL,"
+                " hash TEXT NOT NULL,"
+                " entry_date TEXT NOT NULL,"
+                " data BLOB NOT NULL,"
+                " PRIMARY KEY (iban, hash)"
+                ") WITHOUT ROWID"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS raw_transactions_date"
+                " ON raw_transactions (iban, entry_date)"
+            )
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def add(self, iban, transactions):
+        rows = [
+            (
+                iban,
+                content_hash(data),
+                booking_date(data).isoformat(),
+                pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL),
+            )
+            for data in transactions
+        ]
+        with self._lock, self._db:
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO raw_transactions VALUES (?, ?, ?, ?)", rows
+            )
+            added = self._db.total_changes - before
+        logger.debug(f"Stored {added} new of {len(rows)} records for …{iban[-4:]}")
+        return added
+
+    def has(self, iban):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM raw_transactions WHERE iban = ? LIMIT 1", (iban,)
+            ).fetchone()
+        return row is not None
+
+    def read(self, iban, earliest=None, latest=None):
+        query = "SELECT data FROM raw_transactions WHERE iban = ?"
+        params = [iban]
+        if earliest is not None:
+            query += " AND entry_date >= ?"
+            params.append(earliest.isoformat())
+        if latest is not None:
+            query += " AND entry_date <= ?"
+            params.append(latest.isoformat())
+
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY entry_date", params).fetchall()
+        return [pickle.loads(data) for (data,) in rows]
+
+    def hashes(self, iban):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT hash FROM raw_transactions WHERE iban = ?", (iban,)
+            ).fetchall()
+        return {content_hash for (content_hash,) in rows}
+
+    def read_hashes(self, iban, hashes):
+        """(hash, record) pairs of the given content hashes."""
+        rows = []
+        with self._lock:
+            for chunk in chunked(list(hashes), QUERY_PARAMETERS):
+                placeholders = ", ".join("?" * len(chunk))
+                rows.extend(
+                    self._db.execute(
+                        "SELECT hash, data FROM raw_transactions"
+                        f" WHERE iban = ? AND hash IN ({placeholders})",
+                        (iban, *chunk),
+                    )
+                )
+        return [(content_hash, pickle.loads(data)) for content_hash, data in rows]
+
+    def add_snapshot(self, iban, records, taken=None):
+        """Store records fetched together, e.g. holdings, as one snapshot.
+
+        Unlike single records, snapshots are not deduplicated by content, so
+        equal positions and repeated fetches on one day stay apart.
+        """
+        taken = taken or datetime.now()
+        row = (
+            iban,
+            f"{SNAPSHOT_PREFIX}{taken:%Y%m%dT%H%M%S%f}",
+            taken.date().isoformat(),
+            pickle.dumps(list(records), protocol=pickle.HIGHEST_PROTOCOL),
+        )
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO raw_transactions VALUES (?, ?, ?, ?)", row
+            )
+        logger.debug(f"Stored a snapshot of {len(records)} records for …{iban[-4:]}")
+
+    def read_snapshot(self, iban):
+        """Records of the most recent snapshot, empty without one."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM raw_transactions WHERE iban = ? AND hash LIKE ?"
+                " ORDER BY entry_date DESC, hash DESC LIMIT 1",
+                (iban, f"{SNAPSHOT_PREFIX}%"),
+            ).fetchone()
+        return [] if row is None else pickle.loads(row[0])
+
+
+@lru_cache(maxsize=1)
+def get_transaction_store():
+    return TransactionStore(CACHE_HOME / "transactions.sqlite3")
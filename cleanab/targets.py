@@ -0,0 +1,59 @@
+from logzero import logger
+
+from .apps.base import UploadError, load_app
+
+
+class AppTarget:
+    """A budgeting app to upload to, with its own import index and results."""
+
+    def __init__(self, name, app):
+        self.name = name
+        self.app = app
+        self.import_index = None
+        self._accounts = {}
+        self.reset()
+
+    @classmethod
+    def from_config(cls, target):
+        App, Config = load_app(target.module)
+        return cls(target.name, App(Config.parse_obj(target.config)))
+
+    def __str__(self):
+        return str(self.app)
+
+    def reset(self):
+        self.balances = None
+        self.new = []
+        self.duplicates = []
+        self.failed_ibans = set()
+
+    def account_for(self, account):
+        # The account with its id in this app, as augment_transaction expects
+        if account not in self._accounts:
+            app_id = account.per_app_ids.get(self.name, account.per_app_id)
+            self._accounts[account] = account.copy(update={"per_app_id": app_id})
+        return self._accounts[account]
+
+    async def get_balance(self, account):
+        # One lookup of all balances per run, however many holding accounts
+        if self.balances is None:
+            self.balances = await self.app.get_account_balances_async()
+        return self.balances[account.per_app_id]
+
+    def is_known(self, import_id):
+        return self.import_index is not None and import_id in self.import_index
+
+    async def upload(self, transactions, ibans):
+        logger.info(f"Creating {len(transactions)} transactions in {self}")
+        try:
+            new, duplicates = await self.app.create_transactions_async(transactions)
+        except UploadError as exc:
+            logger.error(f"Upload to {self} incomplete: {exc}")
+            new, duplicates = exc.new, exc.duplicates
+            self.failed_ibans.update(ibans)
+        except Exception:
+            logger.exception("Uploading to %s failed", self)
+            new, duplicates = [], []
+            self.failed_ibans.update(ibans)
+        self.new.extend(new)
+        self.duplicates.extend(duplicates)
@@ -2,14 +2,41 @@ import re
 from datetime import date
 from hashlib import md5
 
+import logzero
 from logzero import logger
 
+from .changes import ChangeReport
+from .constants import FIELDS_TO_CLEAN_UP
 from .models import FintsTransaction
 
 re_cc_purpose = re.compile(r"^(.+?)([A-Z]{3})\s{3,}([0-9,]+)(.*)$")
 
+# Cleaner of a worker process, set up once by `init_worker`
+_worker_cleaner = None
 
-def process_transaction(transaction, cleaner):
+
+def cleaning_input(data):
+    """The fields handed to the cleaner, with card payments split up."""
+    local_data = {field: data.get(field) for field in FIELDS_TO_CLEAN_UP}
+    purpose = local_data["purpose"]
+    if not local_data["applicant_name"] and purpose:
+        result = re_cc_purpose.search(purpose)
+        if result:
+            splits = result.groups()
+            local_data["applicant_name"] = splits[0]
+            local_data["purpose"] = " ".join(splits[1:])
+    return local_data
+
+
+def cleaned_fields(local_data):
+    """Payee and purpose as uploaded, from the cleaner's output."""
+    purpose = local_data["purpose"] or ""
+    if len(purpose) > 200:
+        purpose = purpose[:200]
+    return local_data["applicant_name"] or "", purpose
+
+
+def process_transaction(transaction, cleaner, report=None):
     data = transaction
 
     entry_date = data.get("entry_date") or data["date"]
@@ -26,45 +53,36 @@ def process_transaction(transaction, cleaner):
         ).encode("utf-8")
     ).hexdigest()
 
-    local_data = data.copy()
-    if len(applicant_name) == 0 and len(purpose) > 0:
-        result = re_cc_purpose.search(purpose)
-        if result:
-            splits = result.groups()
-            local_data["applicant_name"] = splits[0]
-            local_data["purpose"] = " ".join(splits[1:])
+    local_data = cleaner.clean(cleaning_input(data))
 
-    local_data = cleaner.clean(local_data)
-
-    echo_if_changed(data, local_data, cleaner=cleaner, import_id=import_id)
-
-    purpose = local_data.get("purpose", "")
-    if purpose and len(purpose) > 200:
-        purpose = purpose[:200]
+    if report is not None:
+        report.compare(data, local_data, fields=cleaner.fields, import_id=import_id)
 
+    applicant_name, purpose = cleaned_fields(local_data)
     return FintsTransaction(
         date=entry_date,
         amount=amount,
-        applicant_name=local_data["applicant_name"],
+        applicant_name=applicant_name,
         purpose=purpose,
         import_id=import_id,
     )
 
 
-def echo_if_changed(original_data, data, *, cleaner, import_id):
-    logger.debug("---")
-    logger.debug("Transaction %s", import_id)
+def init_worker(cleaner, loglevel):
+    global _worker_cleaner
+    _worker_cleaner = cleaner
+    logzero.loglevel(loglevel)
 
-    for field in cleaner.fields:
-        previous = original_data.get(field, "") or ""
-        cleaned = data.get(field, "") or ""
 
-        log = logger.info
-        prefix_in = prefix_out = "  "
-        if previous != cleaned:
-            log = logger.warning
-            prefix_in = "--"
-            prefix_out = "++"
-
-        log("%16s %s %s", field, prefix_in, previous)
-        log("%16s %s %s", field, prefix_out, cleaned)
+def process_chunk(transactions, collect_changes=False):
+    report = ChangeReport() if collect_changes else None
+    processed = [
+        process_transaction(transaction, _worker_cleaner, report)
+        for transaction in transactions
+    ]
+    cache = _worker_cleaner.cache
+    return (
+        processed,
+        report.changes if report is not None else [],
+        cache.collect() if cache is not None else None,
+    )
@@ -1,14 +1,27 @@
 import os
 import re
 import sys
-from functools import lru_cache
+from functools import cached_property, lru_cache
 from pathlib import Path
-
-from cleanab.models.cleaner import ReplacementDefinition
+from typing import TYPE_CHECKING
 
 from . import constants
 
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+if TYPE_CHECKING:
+    from .models.cleaner import ReplacementDefinition
+
 re_wordsplits = re.compile(r"([^\s\-]+(\s|$))")
+# Backreferences and named groups would change meaning or clash once a pattern
+# becomes part of a larger alternation.
+re_unmergeable = re.compile(r"\\(?:[1-9]|g<)|\(\?P[<=]|\(\?\(")
+# ASCII letters that also match non-ASCII characters case-insensitively (ı, ſ, K),
+# which lowercasing the searched string would not account for.
+UNFOLDABLE_LETTERS = frozenset("iksIKS")
 
 if sys.platform == "darwin":
     CACHE_HOME = Path("~/Library/Caches").expanduser() / constants.NAME
@@ -18,6 +31,26 @@ else:
     )
 
 
+def write_atomic(path, data, private=False):
+    """Atomically write bytes to a file, private to the current user if asked."""
+    path.parent.mkdir(mode=0o700 if private else 0o777, parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    fd = os.open(
+        tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 if private else 0o666
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def chunked(sequence, size):
+    for start in range(0, len(sequence), size):
+        yield sequence[start : start + size]
+
+
 def _replace_capitalize(match):
     return match.group(1).capitalize()
 
@@ -26,33 +59,250 @@ def capitalize_string(string):
     return re_wordsplits.sub(_replace_capitalize, string)
 
 
-@lru_cache()
-def simple_replace_instance(string, replacement=""):
-    def replace(x):
-        return x.replace(string, replacement), {}
+class SimpleReplace:
+    def __init__(self, string, replacement=""):
+        self.string = string
+        self.replacement = replacement
 
-    return replace
+    def __call__(self, x):
+        return x.replace(self.string, self.replacement), {}
 
 
-@lru_cache()
-def regex_sub_instance(entry: ReplacementDefinition):
-    pattern = entry.pattern
-    if not entry.regex:
-        pattern = re.escape(pattern)
-    regex = re.compile(
-        pattern,
-        flags=re.IGNORECASE if entry.caseinsensitive else 0,
-    )
+class LazyPattern:
+    """Compiles its pattern eagerly, but only on first use once unpickled."""
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("regex", None)
+        return state
+
 
-    def substitute(x):
+class RegexSub(LazyPattern):
+    def __init__(self, entry: "ReplacementDefinition"):
+        self.entry = entry
+        # Compile right away, so invalid patterns fail along with the config
+        self.regex = self.regex
+
+    @cached_property
+    def regex(self):
+        pattern = self.entry.pattern
+        if not self.entry.regex:
+            pattern = re.escape(pattern)
+        return re.compile(
+            pattern,
+            flags=re.IGNORECASE if self.entry.caseinsensitive else 0,
+        )
+
+    def __call__(self, x):
         transformed = {}
-        for field, template in entry.transform.items():
-            match = regex.search(x)
+        for field, template in self.entry.transform.items():
+            match = self.regex.search(x)
             if not match:
                 continue
 
             transformed[field] = match.expand(template)
 
-        return regex.sub(entry.repl, x), transformed
+        return self.regex.sub(self.entry.repl, x), transformed
+
+
+class RuleGroup(LazyPattern):
+    def __init__(self, gate_patterns, cleaners):
+        self.gate_patterns = gate_patterns
+        self.cleaners = cleaners
+        self.regex = self.regex
+
+    @cached_property
+    def regex(self):
+        return re.compile("|".join(self.gate_patterns))
+
+    def __call__(self, x):
+        # If none of the patterns occurs, every cleaner of the group would be a
+        # no-op. Otherwise run them in order to keep the sequential semantics.
+        if not self.regex.search(x):
+            return x, {}
+
+        transformed = {}
+        for cleaner in self.cleaners:
+            x, local_transformed = cleaner(x)
+            transformed.update(local_transformed)
+        return x, transformed
+
+
+class Finalizer:
+    def __init__(self, config):
+        self.capitalize = config.capitalize
+        self.strip = config.strip
+
+    def __call__(self, string):
+        if self.capitalize:
+            string = capitalize_string(string)
+
+        if self.strip:
+            string = string.strip()
+
+        return string
+
+
+@lru_cache()
+def simple_replace_instance(string, replacement=""):
+    return SimpleReplace(string, replacement)
+
+
+@lru_cache()
+def regex_sub_instance(entry: "ReplacementDefinition"):
+    return RegexSub(entry)
+
+
+def gate_pattern(entry):
+    """Pattern matching wherever the cleaner for `entry` could change a string.
+
+    Returns None for entries that cannot be merged into a combined pattern.
+    """
+    from .models.cleaner import ReplacementDefinition
+
+    if isinstance(entry, str):
+        return re.escape(entry)
+
+    if not isinstance(entry, ReplacementDefinition):
+        return None
+
+    pattern = entry.pattern if entry.regex else re.escape(entry.pattern)
+    if re_unmergeable.search(pattern):
+        return None
+
+    pattern = f"(?i:{pattern})" if entry.caseinsensitive else f"(?:{pattern})"
+    try:
+        re.compile(pattern)
+    except re.error:
+        return None
+    return pattern
+
+
+def _is_foldable(char):
+    return char.isascii() and char not in UNFOLDABLE_LETTERS
+
+
+def required_literal(entry):
+    """Longest substring every match of the cleaner for `entry` contains.
+
+    Returns a (literal, ignorecase) tuple, or None if no literal is required.
+    Case-insensitive literals only consist of characters for which lowercasing
+    the searched string is equivalent to re's case-insensitive matching.
+    """
+    from .models.cleaner import ReplacementDefinition
+
+    if isinstance(entry, str):
+        return (entry, False) if entry else None
+
+    if not isinstance(entry, ReplacementDefinition):
+        return None
+
+    pattern = entry.pattern if entry.regex else re.escape(entry.pattern)
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE if entry.caseinsensitive else 0)
+    except re.error:
+        return None
+
+    ignorecase = bool(parsed.state.flags & re.IGNORECASE)
+    longest, run = "", []
+    for op, value in [*parsed, (None, None)]:
+        if op == sre_parse.LITERAL and (not ignorecase or _is_foldable(chr(value))):
+            run.append(chr(value))
+            continue
+
+        if len(run) > len(longest):
+            longest = "".join(run)
+        run = []
+
+    if not longest:
+        return None
+    return (longest.lower() if ignorecase else longest), ignorecase
+
+
+class LiteralIndex:
+    """Finds which of many literals occur in a string.
+
+    Few literals are simply checked one by one. With many, only those whose
+    first n-gram occurs in the string are checked.
+    """
+
+    GRAM_SIZE = 3
+    # Collecting the n-grams per character of a string costs about as much as
+    # checking this many literals (measured with 600 and 3000 rules)
+    GRAM_COST = 15
+
+    def __init__(self, literals):
+        self.literals = []
+        self.exact = {}
+        self.folded = {}
+        self.short = []
+        for position, literal in enumerate(literals):
+            if literal is None:
+                continue
+
+            text, ignorecase = literal
+            self.literals.append((position, text, ignorecase))
+            if len(text) < self.GRAM_SIZE:
+                self.short.append((position, text, ignorecase))
+                continue
+
+            table = self.folded if ignorecase else self.exact
+            table.setdefault(text[: self.GRAM_SIZE], []).append((position, text))
+        self.fold = any(ignorecase for _, _, ignorecase in self.literals)
+
+    def _grams(self, string):
+        size = self.GRAM_SIZE
+        return {string[i : i + size] for i in range(len(string) - size + 1)}
+
+    def search(self, string):
+        folded = string.lower() if self.fold else None
+        if len(string) * self.GRAM_COST >= len(self.literals):
+            return {
+                position
+                for position, text, ignorecase in self.literals
+                if text in (folded if ignorecase else string)
+            }
+
+        found = {
+            position
+            for position, text, ignorecase in self.short
+            if text in (folded if ignorecase else string)
+        }
+        for table, searched in ((self.exact, string), (self.folded, folded)):
+            if not table:
+                continue
+
+            for gram in self._grams(searched).intersection(table):
+                for position, text in table[gram]:
+                    if text in searched:
+                        found.add(position)
+        return found
+
+
+class PrefilteredRules:
+    def __init__(self, cleaners, literals):
+        self.cleaners = cleaners
+        self.literals = literals
+        self.index = LiteralIndex(literals)
+
+    def __call__(self, x):
+        transformed = {}
+        present = None
+        for position, cleaner in enumerate(self.cleaners):
+            if self.literals[position] is not None:
+                if present is None:
+                    present = self.index.search(x)
+                # Without its literal, the rule cannot match
+                if position not in present:
+                    continue
+
+            cleaned, local_transformed = cleaner(x)
+            transformed.update(local_transformed)
+            if cleaned != x:
+                # Literals may have appeared or disappeared
+                x, present = cleaned, None
+        return x, transformed
+
 
-    return substitute
+def rule_group_instance(gate_patterns, cleaners):
+    return RuleGroup(gate_patterns, cleaners)